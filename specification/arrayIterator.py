@@ -0,0 +1,299 @@
+#file: arrayIterator.py
+#Value iteration on numpy arrays for specs whose maximum is a single vector
+
+import multiprocessing
+import traceback
+from collections import defaultdict
+
+import numpy
+
+from specification import *
+from iterationStats import log
+from valueIterator import ValueIterator
+
+#Largest change between two Q arrays, NaN (no value) counts as far away
+def arrayDist(Qx, Qy):
+    if not Qx.size:
+        return 0
+    same = (Qx == Qy) | (numpy.isnan(Qx) & numpy.isnan(Qy))
+    diff = numpy.where(same, 0, numpy.abs(Qx - Qy))
+    diff[numpy.isnan(diff)] = numpy.inf
+    return diff.max()
+
+#Zero filled array in memory that forked processes share
+def sharedArray(shape):
+    size = int(numpy.prod(shape))
+    buf = multiprocessing.RawArray('d', size or 1) #can't be empty
+    return numpy.frombuffer(buf)[:size].reshape(shape)
+
+class ArrayValueIterator(ValueIterator):
+
+    backend = 'array'
+    workers = 1 #processes sharing each sweep (see iterateParallel)
+
+    #Run value iteration with Q held as a (rows, objectives) array
+    def __init__(self, ts, rfs, worth, **options):
+        #ts : TransitionStructure
+        #rfs : Vector valued reward function
+        #worth : linear spec, or Lex of linear specs, that tells every
+        #        reward vector apart (see classify)
+        #options : as for ValueIterator
+        self.configure(options)
+        #measuring : whether every sweep works out how far it moved Q, as
+        #for ValueIterator (the final sweep always does)
+        self.measuring = self.tolerance is not None or \
+                         self.observer is not None
+        if self.inPlace or self.scc or self.prioritized:
+            raise ValueError("ArrayValueIterator only does full sweeps")
+        if classify(worth) == 'general': #maxima might not be single vectors
+            raise ValueError("ArrayValueIterator needs a linear spec")
+        #given : the structure as passed in, edits : its edit count now,
+        #so that a later warm start can tell what has changed since
+        self.given = ts
+        self.edits = ts.edits
+        ts = self.prune(ts)
+        self.ts = ts
+        self.rfs = rfs
+        self.spec = worth
+        self.problem = self.identify() #checked by a later warm start
+        self.worth = worth.compile(batch=True) #scores every row at once
+        self.cs = ts.compile()
+        cs = self.cs
+
+        self.R = cs.rewards(rfs) #row i : rewards of state i
+        R = self.R
+        k = R.shape[1]
+        if classify(worth, k) == 'general': #vectors can tie
+            raise ValueError("ArrayValueIterator needs a spec that tells "
+                             "every reward vector apart")
+
+        #Same starting point as ValueIterator: every Q is the zero vector
+        self.Qa = numpy.zeros((cs.numRows(), k))
+        #or from an earlier result (every row is still swept, but fewer
+        #sweeps are needed to reach tolerance)
+        if self.warm is not None:
+            Q = dict()
+            self.warmStart(Q)
+            for (row, pair) in enumerate(cs.rows):
+                vals = Q.get(pair)
+                if vals is not None and len(vals) <= 1:
+                    self.Qa[row] = list(vals)[0] if vals else numpy.nan
+        Rrows = R[cs.rowState]
+        self.iterations = 0
+        self.residual = float('inf')
+        self.pruneError = 0 #single values are never pruned
+        self.backups = 0
+        self.worthCalls = 0
+        self.startObserving()
+        if self.workers > 1 and multiprocessing.current_process().daemon:
+            #e.g. in a Pool worker, which can't start processes of its own
+            log.warning("Daemonic processes can't start workers, sweeping "
+                        "in this process")
+            self.iterate(Rrows)
+        elif self.workers > 1 and cs.numStates() > 1:
+            self.iterateParallel(Rrows)
+        else:
+            self.iterate(Rrows)
+
+        #Finally truncate if applicable
+        if self.spec.truncate:
+            self.Qa = numpy.array([self.truncateVec(vec)
+                                   for vec in self.Qa.tolist()],
+                                  dtype=float).reshape(self.Qa.shape)
+
+        #Q : dict<(state, action), frozenset of one vector (or empty)>,
+        #a defaultdict like ValueIterator's
+        self.Q = defaultdict(lambda: frozenset([(0,) * k]))
+        for (st, act), vec in zip(cs.rows, self.Qa.tolist()):
+            if any(x != x for x in vec): #NaN marks no maximum
+                self.Q[(st, act)] = frozenset([])
+            else:
+                self.Q[(st, act)] = frozenset([tuple(vec)])
+
+    #Truncate a single vector
+    def truncateVec(self, vec):
+        return [round(component, 3) for component in vec]
+
+    #Stats for observe: every row is one value, or none if it is NaN,
+    #and every state is swept
+    def observe(self, residual):
+        if self.observer is None:
+            return
+        self.valueCount = len(self.Qa) - int(numpy.isnan(self.Qa).any(axis=1)
+                                                  .sum())
+        self.largest = 1 if self.valueCount else 0
+        self.touched = self.cs.states
+        ValueIterator.observe(self, residual)
+
+    #Worth of every row as an array (rows, levels)
+    def keys(self, Q):
+        self.worthCalls += len(Q)
+        if not len(Q):
+            return numpy.zeros((0, 1))
+        with numpy.errstate(invalid='ignore'): #NaN rows stay NaN
+            return self.worth(Q).reshape(len(Q), -1)
+
+    #Do the sweeps in this process
+    def iterate(self, Rrows):
+        cs = self.cs
+        for run in range(self.runs):
+            V = self.values(self.Qa)
+            Qnext = Rrows + self.gamma * cs.expect(V)
+            if self.measuring or run == self.runs - 1:
+                self.residual = arrayDist(self.Qa, Qnext)
+            else:
+                self.residual = None
+            self.Qa = Qnext
+            self.iterations += 1
+            self.backups += cs.numRows()
+            self.observe(self.residual)
+            if self.converged():
+                break
+
+    #Do the sweeps in forked worker processes, each owning a block of
+    #states and their rows. Q and two V buffers live in shared memory:
+    #in each sweep a worker reads all of one V buffer, writes its own
+    #rows of Q and its own states' values into the other V buffer, then
+    #reports its residual if asked to. The results match iterate() exactly.
+    #A worker that fails sends back its traceback, one that dies closes
+    #its pipe. Either raises RuntimeError here and stops the rest.
+    def iterateParallel(self, Rrows):
+        cs = self.cs
+        k = Rrows.shape[1]
+        Q = sharedArray(self.Qa.shape)
+        Q[:] = self.Qa #zeros, or the warm start
+        V = [sharedArray((cs.numStates(), k)) for parity in range(2)]
+        V[0][:] = self.values(self.Qa)
+
+        #Blocks of whole states with about the same number of transitions
+        self.Qa = Q #so that observe sees each sweep's values
+        blocks = self.partition(min(self.workers, cs.numStates()))
+        workers = []
+        for (first, last) in blocks:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=self.worker, args=(child, first, last, Rrows, Q, V))
+            process.daemon = True
+            process.start()
+            child.close() #so the pipe breaks if the worker dies
+            workers.append((process, parent))
+        try:
+            for run in range(self.runs):
+                measure = self.measuring or run == self.runs - 1
+                for process, conn in workers:
+                    try:
+                        #which V buffer to read, and whether to measure
+                        conn.send((run % 2, measure))
+                    except IOError:
+                        raise self.lost(process)
+                replies = []
+                for process, conn in workers:
+                    try:
+                        replies.append(conn.recv())
+                    except (EOFError, IOError): #closed or reset: it died
+                        raise self.lost(process)
+                for reply in replies:
+                    if isinstance(reply, str): #traceback from a worker
+                        raise RuntimeError(reply)
+                self.residual = max(replies) if measure else None
+                self.iterations += 1
+                self.backups += cs.numRows()
+                if run: #the workers scored the rows this sweep started from
+                    self.worthCalls += cs.numRows()
+                self.observe(self.residual)
+                if self.converged():
+                    break
+        except:
+            for process, conn in workers:
+                process.terminate()
+            raise
+        finally:
+            for process, conn in workers:
+                try:
+                    conn.send(None)
+                except IOError: #gone already
+                    pass
+            for process, conn in workers:
+                process.join()
+                conn.close()
+        self.Qa = numpy.array(Q)
+
+    #Error for a worker process that went away without replying
+    def lost(self, process):
+        process.join()
+        return RuntimeError("Worker process %d exited with code %s" %
+                            (process.pid, process.exitcode))
+
+    #Split the states into contiguous blocks of similar transition counts
+    #Returns [(first state id, last state id + 1)]
+    def partition(self, count):
+        cs = self.cs
+        #transitions up to the start of each state
+        before = cs.indptr[cs.stateStart]
+        cuts = numpy.searchsorted(before, numpy.linspace(0, before[-1],
+                                                         count + 1)[1:-1])
+        bounds = [0] + sorted(set(cuts.tolist()) - {0, cs.numStates()}) + \
+                 [cs.numStates()]
+        return zip(bounds[:-1], bounds[1:])
+
+    #Body of one worker process (see iterateParallel)
+    #Errors are sent back as tracebacks in place of a residual
+    def worker(self, conn, first, last, Rrows, Q, V):
+        try:
+            cs = self.cs
+            start, stop = cs.stateStart[first], cs.stateStart[last]
+            P = cs.select(numpy.arange(start, stop))
+            R = Rrows[start:stop]
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+        for parity, measure in iter(conn.recv, None):
+            if error is None:
+                try:
+                    Qnext = R + self.gamma * P.dot(V[parity])
+                    residual = None
+                    if measure:
+                        residual = arrayDist(Q[start:stop], Qnext)
+                    Q[start:stop] = Qnext
+                    V[1 - parity][first:last] = self.values(Qnext, first,
+                                                            last)
+                    conn.send(residual)
+                    continue
+                except Exception:
+                    error = traceback.format_exc()
+            conn.send(error)
+
+    #Best value of every state (NaN where there is nothing to maximise)
+    #Q holds the rows of states first to last - 1 (all of them by default)
+    def values(self, Q, first=0, last=None):
+        cs = self.cs
+        if last is None:
+            last = cs.numStates()
+        offset = cs.stateStart[first]
+        rowState = cs.rowState[offset:cs.stateStart[last]]
+        stateStart = cs.stateStart[first:last + 1] - offset
+        keys = self.keys(Q)
+        #Sort rows by state, then by worth (best first, NaN last).
+        #lexsort is stable so ties keep the first action.
+        order = numpy.lexsort([-keys[:, j]
+                               for j in reversed(range(keys.shape[1]))] +
+                              [rowState])
+        V = numpy.empty((last - first, Q.shape[1]))
+        V.fill(numpy.nan)
+        starts = stateStart[:-1]
+        has = stateStart[1:] > starts
+        V[has] = Q[order[starts[has]]]
+        return V
+
+    #Return the set of maximal actions from a state
+    def policy(self, st):
+        if st not in self.cs.stateIds:
+            return set([])
+        rows = self.cs.rowsOf(st)
+        keys = self.keys(self.Qa[rows]).tolist()
+        valid = [(tuple(key), row) for key, row in zip(keys, rows)
+                 if not any(x != x for x in key)]
+        if not valid:
+            return set([])
+        best = max(key for (key, row) in valid)
+        return {self.cs.rows[row][1] for (key, row) in valid if key == best}
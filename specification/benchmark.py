@@ -0,0 +1,244 @@
+#file: benchmark.py
+#Time and peak memory of the solvers on scalable models. Results can be
+#saved as JSON and checked against an earlier run:
+#  python benchmark.py --out base.json
+#  python benchmark.py --baseline base.json   (exits 1 on a regression)
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+import traceback
+from collections import OrderedDict
+
+import zoo
+from specification import *
+from solver import solve
+from arrayIterator import ArrayValueIterator
+from policyIterator import PolicyIterator
+
+#Run fn in a child process so that its peak memory can be read on its own
+#Returns (seconds, peak resident set size in KB, what fn returned), the
+#last coming back through a pipe as JSON
+def measure(fn):
+    start = time.time()
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0: #child
+        try:
+            os.close(read)
+            try:
+                reply = {'result': fn()}
+            except Exception:
+                reply = {'error': traceback.format_exc()}
+            with os.fdopen(write, 'w') as pipe:
+                json.dump(reply, pipe)
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as pipe:
+        reply = pipe.read()
+    _, status, usage = os.wait4(pid, 0)
+    seconds = time.time() - start
+    if not reply:
+        raise RuntimeError("Benchmark process exited with status %d" % status)
+    reply = json.loads(reply)
+    if 'error' in reply:
+        raise RuntimeError(reply['error'])
+    return seconds, usage.ru_maxrss, reply['result']
+
+#Models to measure, scale times the size of the full suite:
+#[(name, structure builder, rewards builder, spec, solver options)]
+#The builders take no arguments so that construction is timed alone.
+#Value sets under general specs grow with every sweep, so those cases are
+#smaller and keep at most cap values from each successor.
+def cases(scale=1):
+    def size(n):
+        return max(2, int(n * scale))
+    X, Y, Z = ID(0), ID(1), ID(2)
+    G, W = ID(0), ID(1)
+    side, length, large, small = size(60), size(5000), size(2000), size(40)
+    general = dict(cap=3, runs=30)
+
+    #Random sparse MDP with 3 actions a state
+    def random(n, branching, k, name, worth, options=dict()):
+        return ('random(%d, b=%d, k=%d) %s' % (n, branching, k, name),
+                lambda: zoo.randomStructure(n, 3, branching, seed=n),
+                lambda: zoo.randomRewards(n, k, seed=n), worth, options)
+
+    return [
+        ('tgrid(%d, %d, .8) Lex' % (side, side),
+         lambda: zoo.tgridStructure(side, side, .8), zoo.tgridRewards,
+         Lex(X, Y), dict()),
+        ('hallway(%d, .5) Lex Gt' % length,
+         lambda: zoo.hallwayStructure(length, .5), zoo.hallwayRewards,
+         Lex(G > 0, -W), dict()),
+        random(large, 4, 1, 'ID', X),
+        random(large, 8, 3, 'Lex', Lex(X, Y + Z, Z)),
+        random(small, 2, 2, 'Gte', X >= Y, general),
+        random(small, 2, 2, 'Gt', X > .5, general),
+        random(small, 2, 2, '|', X | Y, general),
+    ]
+
+#Policy iteration can cycle under general specs, so stop it after this
+#many rounds (the rounds column shows where it did)
+maxRounds = 20
+
+#Build and solve one case, timing each step (run in its own process by run)
+#Returns the case's stats, see run
+def profile(structure, rewards, worth, options):
+    stats = OrderedDict()
+    start = time.time()
+    ts = structure()
+    rfs = rewards()
+    stats['build seconds'] = time.time() - start
+    states = ts.getStates()
+    stats['states'] = len(states)
+    stats['actions'] = sum(len(ts.getActions(st)) for st in states)
+
+    start = time.time()
+    result = solve(ts, rfs, worth, tolerance=1e-6, **options)
+    stats['solve seconds'] = time.time() - start
+    stats['backend'] = result.backend
+    stats['iterations'] = result.iterations
+    sizes = [len(vals) for vals in result.Q.values()]
+    stats['total values'] = sum(sizes)
+    stats['max values'] = max(sizes or [0])
+
+    start = time.time()
+    for st in states:
+        result.policy(st)
+    stats['policy seconds'] = time.time() - start
+
+    start = time.time()
+    iterator = PolicyIterator(ts, rfs, worth, maxRounds=maxRounds)
+    stats['policy iteration seconds'] = time.time() - start
+    stats['rounds'] = iterator.rounds
+    return stats
+
+#Solve every case in its own process
+#Returns {'platform', 'python', 'date', 'cases'} where cases maps each
+#case's name to its stats from profile, plus its peak memory above an
+#idle process in KB
+#log : file to print a table to as the cases finish
+def run(scale=1, log=None):
+    results = OrderedDict([
+        ('platform', platform.platform()),
+        ('python', platform.python_version()),
+        ('date', time.strftime('%Y-%m-%d %H:%M:%S')),
+        ('cases', OrderedDict()),
+    ])
+    idle = measure(lambda: None)[1]
+    if log is not None:
+        print >>log, "%-32s %8s %8s %8s %8s %10s %8s" % (
+            "case", "build", "solve", "policy", "PI", "peak KB", "values")
+        print >>log, "-" * 90
+    for name, structure, rewards, worth, options in cases(scale):
+        seconds, peak, stats = measure(
+            lambda: profile(structure, rewards, worth, options))
+        stats['peak KB'] = peak - idle
+        results['cases'][name] = stats
+        if log is not None:
+            print >>log, "%-32s %8.3f %8.3f %8.3f %8.3f %10d %8d" % (
+                name, stats['build seconds'], stats['solve seconds'],
+                stats['policy seconds'], stats['policy iteration seconds'],
+                stats['peak KB'], stats['total values'])
+            log.flush()
+    return results
+
+#Stats where bigger is worse, with how much they can grow before it
+#counts (timings and memory are noisy on small cases)
+costs = OrderedDict([
+    ('build seconds', .1),
+    ('solve seconds', .1),
+    ('policy seconds', .1),
+    ('policy iteration seconds', .1),
+    ('peak KB', 2048),
+    ('total values', 0),
+])
+
+#Find the costs that grew by more than threshold (.25 is 25%) since the
+#baseline, for the cases both runs have
+#Returns [(case, cost, baseline value, new value)]
+def compare(results, baseline, threshold=.25):
+    regressions = []
+    for name, stats in results['cases'].items():
+        old = baseline['cases'].get(name)
+        if old is None:
+            continue
+        for cost, slack in costs.items():
+            if cost not in stats or cost not in old:
+                continue
+            if stats[cost] > old[cost] * (1 + threshold) and \
+               stats[cost] - old[cost] > slack:
+                regressions.append((name, cost, old[cost], stats[cost]))
+    return regressions
+
+#Time the sweeps of one model with ArrayValueIterator split over 1, 2, ...
+#processes. The structure, rewards and compiled arrays are built once up
+#front, and the setup that is left in the iterator is timed on its own (with
+#no sweeps) and taken off, so only the sweeps count.
+#Returns [(workers, seconds, speedup over one worker)]
+def scaling(counts=None, size=100):
+    if counts is None:
+        counts = range(1, multiprocessing.cpu_count() + 1)
+    ts = zoo.tgridStructure(size, size, .8)
+    rfs = zoo.tgridRewards()
+    ts.compile() #the forked runs all reuse it
+    spec = Lex(ID(0), ID(1))
+    def sweepTime(workers):
+        start = time.time()
+        ArrayValueIterator(ts, rfs, spec, runs=0)
+        setup = time.time() - start
+        start = time.time()
+        ArrayValueIterator(ts, rfs, spec, workers=workers)
+        return time.time() - start - setup
+    times = [(workers, measure(lambda: sweepTime(workers))[2])
+             for workers in counts]
+    return [(workers, seconds, times[0][1] / seconds)
+            for (workers, seconds) in times]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the solvers on scalable models")
+    parser.add_argument('--scale', type=float, default=1,
+                        help="size of the models relative to the full suite")
+    parser.add_argument('--out', help="file to save the results to as JSON")
+    parser.add_argument('--baseline',
+                        help="results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=.25,
+                        help="growth that counts as a regression "
+                             "(default .25, i.e. 25%%)")
+    parser.add_argument('--scaling', action='store_true',
+                        help="also time tgrid(100, 100) over 1, 2, ... "
+                             "worker processes")
+    args = parser.parse_args(argv)
+
+    results = run(args.scale, log=sys.stdout)
+    if args.out is not None:
+        with open(args.out, 'w') as out:
+            json.dump(results, out, indent=2, allow_nan=False)
+    if args.scaling:
+        print
+        print "%20s %10s %12s" % ("tgrid(100, 100) on", "seconds", "speedup")
+        print "-" * 44
+        for workers, seconds, speedup in scaling():
+            print "%12d workers %10.3f %12.2f" % (workers, seconds, speedup)
+    if args.baseline is not None:
+        with open(args.baseline) as base:
+            baseline = json.load(base, object_pairs_hook=OrderedDict)
+        regressions = compare(results, baseline, args.threshold)
+        print
+        for name, cost, old, new in regressions:
+            print "Regression: %s %s %g -> %g" % (name, cost, old, new)
+        if regressions:
+            return 1
+        print "No regressions against %s" % args.baseline
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+#file: compiledStructure.py
+#Array (CSR) form of a TransitionStructure for the array based solvers
+
+import copy
+
+import numpy
+
+from specification import rewardTable
+
+class CompiledStructure:
+    #Flatten a transition structure into contiguous arrays
+    def __init__(self, ts):
+        #ts : TransitionStructure
+        #Dense ids for the state and action labels
+        self.states = list(ts.getStates()) #id -> state
+        self.stateIds = {st: i for (i, st) in enumerate(self.states)}
+        self.actions = list({act for st in self.states
+                             for act in ts.getActions(st)}) #id -> action
+        self.actionIds = {act: i for (i, act) in enumerate(self.actions)}
+
+        #One row per (state, action), grouped by state so that the
+        #actions of state i are rows stateStart[i]:stateStart[i+1]
+        self.rows = [] #row -> (state, action)
+        stateStart = [0]
+        for st in self.states:
+            self.rows.extend((st, act) for act in ts.getActions(st))
+            stateStart.append(len(self.rows))
+        self.rowIds = {key: i for (i, key) in enumerate(self.rows)}
+        self.stateStart = numpy.array(stateStart, dtype=numpy.intp)
+
+        #row -> state id and row -> action id
+        self.rowState = numpy.array([self.stateIds[st]
+                                     for (st, act) in self.rows],
+                                    dtype=numpy.intp)
+        self.rowAction = numpy.array([self.actionIds[act]
+                                      for (st, act) in self.rows],
+                                     dtype=numpy.intp)
+
+        #CSR transition matrix: row i has successors
+        #indices[indptr[i]:indptr[i+1]] with probabilities probs[...]
+        indptr = [0]
+        indices = []
+        probs = []
+        for (st, act) in self.rows:
+            for sp, prob in ts.successors(st, act).items():
+                indices.append(self.stateIds[sp])
+                probs.append(prob)
+            assert len(indices) > indptr[-1] #every action goes somewhere
+            indptr.append(len(indices))
+        self.matrix = CSRMatrix(numpy.array(indptr, dtype=numpy.intp),
+                                numpy.array(indices, dtype=numpy.intp),
+                                numpy.array(probs, dtype=float),
+                                len(self.states))
+        self.indptr = self.matrix.indptr
+        self.indices = self.matrix.indices
+        self.probs = self.matrix.probs
+        self.rewardTables = dict() #dict<id(rfs), (rfs, table)>, see rewards
+
+    #Compiled form of ts made by swapping in its probabilities, for when
+    #ts has exactly the same states, actions and successors as this one
+    #(None if it doesn't). The reward tables are shared too.
+    def reuse(self, ts):
+        if ts.getStates() != set(self.states) or \
+           sum(len(ts.getActions(st)) for st in self.states) != len(self.rows):
+            return None
+        targets = [self.states[i] for i in self.indices]
+        probs = []
+        for (st, act), start, stop in zip(self.rows, self.indptr[:-1],
+                                          self.indptr[1:]):
+            dist = ts.successors(st, act)
+            if len(dist) != stop - start:
+                return None
+            for sp in targets[start:stop]:
+                if sp not in dist:
+                    return None
+                probs.append(dist[sp])
+        other = copy.copy(self)
+        other.matrix = CSRMatrix(self.indptr, self.indices,
+                                 numpy.array(probs, dtype=float),
+                                 len(self.states))
+        other.probs = other.matrix.probs
+        return other
+
+    #Reward table of rfs for these states (see rewardTable), worked out
+    #once for each reward function
+    def rewards(self, rfs):
+        if id(rfs) not in self.rewardTables:
+            self.rewardTables[id(rfs)] = (rfs, rewardTable(rfs, self.states))
+        return self.rewardTables[id(rfs)][1]
+
+    def numStates(self):
+        return len(self.states)
+
+    def numRows(self):
+        return len(self.rows)
+
+    #Expected next value of every row: sum over s' T(s, a, s')*V[s']
+    #V : array indexed by state id, either (states,) or (states, k)
+    def expect(self, V):
+        return self.matrix.dot(V)
+
+    #Matrix of just the given rows, e.g. one row per state for a policy
+    def select(self, rows):
+        return self.matrix.select(rows)
+
+    #Return the rows belonging to a state label
+    def rowsOf(self, st):
+        i = self.stateIds[st]
+        return range(self.stateStart[i], self.stateStart[i + 1])
+
+
+#Sparse matrix in compressed sparse row form
+class CSRMatrix:
+    def __init__(self, indptr, indices, probs, width):
+        #Row i has entries probs[indptr[i]:indptr[i+1]]
+        #in columns indices[indptr[i]:indptr[i+1]]
+        self.indptr = indptr
+        self.indices = indices
+        self.probs = probs
+        self.shape = (len(indptr) - 1, width)
+        self.rowLength = numpy.diff(indptr)
+        #longRows[j] : rows with more than j entries
+        self.longRows = [numpy.flatnonzero(self.rowLength > j) for j in
+                         range(self.rowLength.max() if len(indices) else 0)]
+
+    #Multiply by V, either (width,) or (width, k)
+    def dot(self, V):
+        V = numpy.asarray(V, dtype=float)
+        if V.ndim == 1:
+            terms = self.probs * V[self.indices]
+        else:
+            terms = self.probs[:, None] * V[self.indices]
+        #Add the terms of each row left to right, like setSum does, so
+        #that results agree with ValueIterator to the last bit
+        if not len(self.longRows):
+            return numpy.zeros((self.shape[0],) + V.shape[1:])
+        total = terms[self.indptr[:-1]]
+        for j in range(1, len(self.longRows)):
+            rows = self.longRows[j]
+            total[rows] += terms[self.indptr[rows] + j]
+        return total
+
+    #Matrix made of the given rows, in that order
+    def select(self, rows):
+        rows = numpy.asarray(rows, dtype=numpy.intp)
+        starts = self.indptr[rows]
+        lengths = self.rowLength[rows]
+        indptr = numpy.concatenate(([0], numpy.cumsum(lengths)))
+        #position of every entry of the new matrix in the old one
+        entries = (numpy.arange(indptr[-1]) - numpy.repeat(indptr[:-1], lengths)
+                   + numpy.repeat(starts, lengths))
+        return CSRMatrix(indptr.astype(numpy.intp), self.indices[entries],
+                         self.probs[entries], self.shape[1])
+
+    #The same matrix as a scipy.sparse.csr_matrix
+    def toScipy(self):
+        import scipy.sparse
+        return scipy.sparse.csr_matrix((self.probs, self.indices, self.indptr),
+                                       shape=self.shape)
@@ -1,5 +1,6 @@
 from zoo import *
 from specification import *
+from sweep import grid, sweep
 
 
 #Ratio choice example, cannot be made with normal reward functions to choose x.
@@ -14,14 +15,17 @@ def ratioSitExample():
     ratioChoiceSit(worth).displayPolicy()
 
 #Littman's Hallway with limit problem
+#Lex(G > 0, -W) is a general spec, so each point is solved on the sets
+#backend from scratch: only the reward function is shared between points
 def hallwayExample():
     G, W, S = ID(0), ID(1), ID(2)
     worth = Lex(G > 0, -W)
+    points = grid(n=[2*x for x in range(1,5)], p=[.2*x + .1 for x in range(5)])
+    rows = sweep('hallway', points, worth, states=['start'])
     print "       n        p    policy('start')"
     print "------------------------------------------"
-    for n in [2*x for x in range(1,5)]:
-        for p in [.2*x + .1 for x in range(5)]:
-            print "%8d %8.2f    %s" % (n, p, hallway(n, p, worth).policy('start'))
+    for row in sorted(rows, key=lambda row: (row['n'], row['p'])):
+        print "%8d %8.2f    %s" % (row['n'], row['p'], row['policy start'])
 
 def hallwaystartExample():
     G, W, S = ID(0), ID(1), ID(2)
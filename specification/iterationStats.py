@@ -0,0 +1,48 @@
+#file: iterationStats.py
+#What a solver did in each sweep or round, for observers to record or log
+#Pass observer=f to ValueIterator, ArrayValueIterator or PolicyIterator to
+#have f called with an IterationStats after every iteration, e.g.
+#    history = []
+#    ValueIterator(ts, rfs, worth, observer=history.append)
+
+import logging
+from collections import OrderedDict
+
+#Logger the solvers write to. It says nothing unless it is set up, e.g.
+#with logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger('specification')
+log.addHandler(logging.NullHandler())
+
+class IterationStats:
+    #Names of the stats, in the order they are shown
+    fields = ['iteration', 'seconds', 'backups', 'values', 'maxValues',
+              'worthCalls', 'residual', 'policyChanges']
+
+    def __init__(self, iteration, seconds, backups, values, maxValues,
+                 worthCalls, residual, policyChanges):
+        self.iteration = iteration #counting from 1
+        self.seconds = seconds #wall time taken
+        self.backups = backups #values computed (Q values, or V for a policy)
+        self.values = values #total size of the value sets afterwards
+        self.maxValues = maxValues #size of the largest set computed
+        self.worthCalls = worthCalls #worth evaluations (cached ones included)
+        self.residual = residual #largest change made
+        #states whose best actions changed (None unless the solver was
+        #asked to track them, see trackPolicy)
+        self.policyChanges = policyChanges
+
+    def __repr__(self):
+        return 'IterationStats(%s)' % ', '.join(
+            '%s=%r' % (name, getattr(self, name)) for name in self.fields)
+
+    #The stats as a dict, e.g. to save as JSON
+    def asDict(self):
+        return OrderedDict((name, getattr(self, name)) for name in self.fields)
+
+#Observer logging every iteration at INFO level
+def logStats(stats):
+    log.info("iteration %d: %.3fs, %d backups, %d values (largest %d), "
+             "%d worth calls, residual %g, %s policy changes",
+             stats.iteration, stats.seconds, stats.backups, stats.values,
+             stats.maxValues, stats.worthCalls, stats.residual,
+             '?' if stats.policyChanges is None else stats.policyChanges)
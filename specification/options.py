@@ -0,0 +1,23 @@
+#file: options.py
+#Settings that the solvers declare as class attributes, e.g.
+#    class Solver(Configurable):
+#        gamma = .9
+#and take as keyword arguments to override them, Solver(..., gamma=.8)
+
+class Configurable:
+    #Class attributes that describe the solver rather than setting it up
+    fixed = ('fixed', 'backend')
+
+    #Set options given to the constructor. Only the settings declared on
+    #the class can be given, not its methods.
+    def configure(self, options):
+        for name, val in options.items():
+            assert name in self.options(), "Unknown option %s" % name
+            setattr(self, name, val)
+
+    #Names of the settings declared on the class (and its bases)
+    @classmethod
+    def options(cls):
+        return [name for name in dir(cls) if not name.startswith('_')
+                and name not in cls.fixed
+                and not callable(getattr(cls, name))]
@@ -2,63 +2,178 @@
 import pydot
 from PIL import Image
 import StringIO
-import copy
 
 from collections import defaultdict
 import random
+import time
+
+import numpy
+try:
+    import scipy.sparse
+    import scipy.sparse.linalg
+except ImportError: #fall back to iterating the Bellman equation
+    scipy = None
 
 from vector import *
-from numpy import mat, eye
+from specification import rewardTable
+from iterationStats import IterationStats, log
+from options import Configurable
+
+#Apply V <- R + gamma*P*V up to sweeps times starting from V, stopping
+#early once a sweep moves V by no more than tolerance
+#Returns (V, sweeps done, change made by the last sweep)
+def sweepPolicy(P, R, gamma, V, sweeps, tolerance=0):
+    V = numpy.array(V, dtype=float)
+    change = float('inf')
+    for sweep in range(sweeps):
+        Vnext = R + gamma * P.dot(V)
+        change = numpy.abs(Vnext - V).max() if V.size else 0
+        V = Vnext
+        if change <= tolerance:
+            return V, sweep + 1, change
+    return V, sweeps, change
+
+#Solve V = R + gamma*P*V for every column of R at once
+#P : CSRMatrix with one row per state (the policy's transitions)
+#R : array (states, objectives)
+#Uses a sparse LU factorisation when scipy is available, otherwise
+#iterates V <- R + gamma*P*V until it moves less than tolerance
+def evaluatePolicy(P, R, gamma, iterative=False, tolerance=1e-12, runs=100000):
+    if scipy is not None and not iterative:
+        A = scipy.sparse.identity(P.shape[0], format='csc') - \
+            gamma * P.toScipy().tocsc()
+        V = scipy.sparse.linalg.splu(A).solve(numpy.asarray(R, dtype=float))
+        return V.reshape(R.shape)
+    return sweepPolicy(P, R, gamma, R, runs, tolerance)[0]
 
-class PolicyIterator:
+class PolicyIterator(Configurable):
     gamma = .8
+    iterative = False #evaluate policies by iteration even if scipy is there
+    sweeps = None #modified policy iteration: sweeps per round (None = exact)
+    tolerance = 1e-12 #modified policy iteration stops below this change
+    maxRounds = 1000 #give up on policies that keep changing
+    seed = None #seed for the random starting policy
+    startPolicy = None #dict<state, action> to start from, e.g. a previous pi
+    initial = None #only solve the states reachable from these (None: all)
+    warm = None #earlier PolicyIterator to take the policy and V from
+    observer = None #called with an IterationStats after every round
 
     #Run policy iteration on a transition structure
-    def __init__(self, ts, rfs, worth):
+    def __init__(self, ts, rfs, worth, **options):
         #ts: TransitionStructure
         #    (Every state should have an action)
         #rfs: Vector valued reward function
         #worth: Translation from rewards to ordering
+        #options: override any of the class attributes above
+        self.configure(options)
+        if self.initial is not None:
+            ts = ts.restrict(ts.reachable(self.initial))
         self.ts = ts
         self.rfs = rfs
-        self.worth = worth
+        self.worth = getattr(worth, 'compile', lambda: worth)()
+        self.cs = ts.compile()
+        #Rewards only depend on the state, so evaluate them once
+        states = self.cs.states
+        R = rewardTable(rfs, states)
+        self.rewards = {st: Vector(R[i]) for (i, st) in enumerate(states)}
         
-        #Choose an arbitrary reference policy
+        #Start from the given policy, choosing arbitrary actions elsewhere
+        start = self.startPolicy
+        if self.warm is not None:
+            start = self.warm.pi
+        rng = random.Random(self.seed)
         self.pi2 = dict()
-        for state in self.ts.getStates():
-            self.pi2[state] = random.choice(list(self.ts.getActions(state)))
+        for state in states:
+            actions = self.ts.getActions(state)
+            if start and start.get(state) in actions:
+                self.pi2[state] = start[state]
+            else:
+                self.pi2[state] = rng.choice(sorted(actions))
         
         self.pi = dict() # Working policy
 
         self.V = dict() # Value function
 
-        while not self.pi == self.pi2:
-            self.pi = copy.deepcopy(self.pi2)
+        self.rounds = 0 #improvement rounds
+        self.converged = False #stopped on a stable policy, not maxRounds
+        self.evalSweeps = 0 #sweeps spent evaluating policies (sweeps mode)
+        self.exactEvals = 0 #policies evaluated exactly (sweeps None)
+        self.worthCalls = 0 #actions scored while improving policies
+        self.residual = float('inf') #change made by the last sweep
+        V = numpy.zeros(R.shape)
+        if self.warm is not None: #sweeps start from the earlier values
+            for (i, st) in enumerate(states):
+                if st in self.warm.V:
+                    V[i] = self.warm.V[st].data
+        while self.pi != self.pi2 or self.residual > self.tolerance:
+            if self.rounds == self.maxRounds:
+                break
+            self.rounds += 1
+            self.pi = self.pi2
             self.pi2 = dict()
+            start = time.time()
+            worthCalls = self.worthCalls
 
-            states = list(self.ts.getStates())
             #Compute the value of policy pi
             #Solve V(s) = R(s) + gamma*sum over s' T(s, pi(s), s')*V(s')
-            # Can be rewritten as V = R*(I - gamma*X)^-1 with:
-            X = mat([[self.ts[(stx, self.pi[stx], sty)] for sty in states]
-                 for stx in states])
-            R = mat([[self.rfs(st)] for st in states])
-            V = (((eye(len(states)) - self.gamma*X).I)*R).A1
+            # Can be rewritten as (I - gamma*X)V = R with X the rows of
+            # the compiled structure that pi picks
+            X = self.cs.select([self.cs.rowIds[(st, self.pi[st])]
+                                for st in states])
+            if self.sweeps is None:
+                V = evaluatePolicy(X, R, self.gamma, self.iterative,
+                                   self.tolerance)
+                self.residual = 0
+                done = 1
+                self.exactEvals += 1
+            else:
+                #Only move towards the value of pi, starting from the
+                #previous round's V since pi changed in few states
+                V, done, self.residual = sweepPolicy(X, R, self.gamma, V,
+                                                     self.sweeps,
+                                                     self.tolerance)
+                self.evalSweeps += done
 
             for i in range(len(states)):
-                self.V[states[i]] = V[i]
-            print self.V
+                self.V[states[i]] = Vector(V[i])
+            log.debug("Round %d values: %s", self.rounds, self.V)
 
             
             #Improve the policy at each state
-            for st in self.ts.getStates():
-                value = lambda act: self.worth(self.rfs(st) +
-                    self.gamma*sum([self.ts[(st, act, sp)]*self.V[sp]
-                                    for sp in states], 
-                                   Vector([0]*len(self.rfs))))
-
-                self.pi2[st] = max((value(act), act) 
-                                   for act in self.ts.getActions(st))[1]
+            #value of an action: R(s) + gamma*sum T(s, act, s')*V(s'),
+            #accumulated into one reused vector
+            #Ties go to the largest action, except when warm started:
+            #then pi's action stays unless another is strictly better, so
+            #the earlier policy isn't changed for nothing
+            acc = Vector.zeros(R.shape[1])
+            for st in states:
+                values = dict()
+                for act in self.ts.getActions(st):
+                    acc.fill(0)
+                    for sp, prob in self.ts.successors(st, act).items():
+                        acc.addScaled(prob, self.V[sp])
+                    acc *= self.gamma
+                    acc += self.rewards[st]
+                    values[act] = self.worth(acc)
+                self.worthCalls += len(values)
+                best = max((value, act) for (act, value) in values.items())
+                if self.warm is not None and values[self.pi[st]] >= best[0]:
+                    self.pi2[st] = self.pi[st]
+                else:
+                    self.pi2[st] = best[1]
+
+            if self.observer is not None:
+                changes = sum(1 for st in states if self.pi2[st] != self.pi[st])
+                self.observer(IterationStats(
+                    self.rounds, time.time() - start, done * len(states),
+                    len(states), 1 if states else 0,
+                    self.worthCalls - worthCalls, self.residual, changes))
+
+        self.converged = self.pi == self.pi2 and \
+                         self.residual <= self.tolerance
+        if not self.converged:
+            log.warning("Policy iteration stopped after %d rounds without "
+                        "converging", self.rounds)
 
     def policy(self, st):
         return self.pi[st]
@@ -0,0 +1,31 @@
+#file: solver.py
+#Pick the cheapest solver that is still correct for a spec
+
+from specification import classify, rewardTable
+from iterationStats import log
+from valueIterator import ValueIterator
+from arrayIterator import ArrayValueIterator
+
+#Run value iteration with the backend suited to the spec
+#The result records the spec's class in .kind and the backend used
+#in .backend ('array' or 'sets')
+def solve(ts, rfs, worth, **options):
+    #options : passed on to the solver, see ValueIterator
+    #Number of objectives, from the rewards of any one state
+    states = ts.getStates()
+    sample = [next(iter(states))] if states else []
+    kind = classify(worth, rewardTable(rfs, sample).shape[1])
+    #Only ValueIterator does anything but full sweeps
+    sequential = any(options.get(name)
+                     for name in ('inPlace', 'scc', 'prioritized'))
+    if kind == 'general' or sequential:
+        #ValueIterator only runs in this process, so workers has no say
+        if options.pop('workers', 1) > 1:
+            log.warning("Solving %s spec on one process: workers only "
+                        "applies to the array backend",
+                        'a sequential' if sequential else 'a general')
+        result = ValueIterator(ts, rfs, worth, **options)
+    else: #every maximal set is a single vector (or empty)
+        result = ArrayValueIterator(ts, rfs, worth, **options)
+    result.kind = kind
+    return result
@@ -1,5 +1,6 @@
 #file: specification.py
 import math
+import numpy
 
 #Make a vector valued RF from a list of scalar valued RFs
 class combineReward:
@@ -9,6 +10,34 @@ class combineReward:
         return tuple(rf(st) for rf in self.rfs)
     def __len__(self):
         return len(self.rfs)
+    #Rewards of a list of states as a (states, objectives) array
+    #RFs with a batch method are called once for all of the states
+    def batch(self, states):
+        columns = [rf.batch(states) if hasattr(rf, 'batch') else
+                   [rf(st) for st in states] for rf in self.rfs]
+        return numpy.array(columns, dtype=float).reshape(
+            len(self.rfs), len(states)).T
+
+#A scalar valued RF with a vectorized version for lists of states
+class batchReward:
+    def __init__(self, rf, batch):
+        #rf : state -> reward
+        #batch : list of states -> sequence of rewards
+        self.rf = rf
+        self.batch = batch
+    def __call__(self, st):
+        return self.rf(st)
+
+#Evaluate a vector valued RF once for every state
+#Returns a (states, objectives) array, row i holding the rewards of states[i]
+def rewardTable(rfs, states):
+    states = list(states)
+    if hasattr(rfs, 'batch'):
+        return numpy.asarray(rfs.batch(states), dtype=float)
+    table = numpy.array([rfs(st) for st in states], dtype=float)
+    if not states:
+        return table.reshape(0, len(rfs) if hasattr(rfs, '__len__') else 0)
+    return table.reshape(len(states), -1)
 
 class Specification:
     truncate = False
@@ -18,6 +47,28 @@ class Specification:
     def __call__(self,vec):
         pass
 
+    #Turn the spec into one flat generated function of a vector
+    #With batch=True the function takes an (n, k) array of vectors
+    #and returns the n values (an (n, levels) array for Lex)
+    def compile(self, batch=False):
+        return Compiler(batch).build(self)
+
+    #Polynomial degree in the reward vector: 0 for constants, 1 for
+    #linear terms, None when not a polynomial of degree <= 1
+    def degree(self):
+        return None
+
+    #Key identifying equal subtrees so they are only evaluated once
+    def key(self):
+        return ('spec', id(self))
+    #Expression computing this node, see Compiler
+    #Specs without their own emit are called as they are
+    def emit(self, compiler):
+        spec = compiler.constant(self)
+        if compiler.batch:
+            return 'numpy.array([%s(vec) for vec in vecs])' % spec
+        return '%s(vec)' % spec
+
     #Sugaring
     def __neg__(self):
         return Negate(self)
@@ -38,6 +89,45 @@ class Specification:
     def __or__(self, other):
         return Add(Gte(other,self), Gte(self, other))
 
+class Compiler:
+    #Build the source of a function evaluating a spec, one line per node
+    def __init__(self, batch):
+        self.batch = batch
+        self.lines = []
+        self.names = dict() #dict<key, variable holding that subtree>
+        self.env = {'numpy': numpy, 'sqrt2': math.sqrt(2)}
+
+    #Name a value the generated code can refer to
+    def constant(self, value):
+        name = 'c%d' % len(self.env)
+        self.env[name] = value
+        return name
+
+    #Return the variable holding a subtree, emitting it if it's new
+    def node(self, spec):
+        key = spec.key()
+        if key not in self.names:
+            expr = spec.emit(self) #emits the children first
+            self.names[key] = 't%d' % len(self.names)
+            self.lines.append('    %s = %s' % (self.names[key], expr))
+        return self.names[key]
+
+    def build(self, spec):
+        if self.batch:
+            self.lines.append('    vecs = numpy.asarray(vecs, dtype=float)')
+            self.lines.append('    zeros = numpy.zeros(len(vecs))')
+            args = 'vecs'
+        else:
+            args = 'vec'
+        result = self.node(spec)
+        source = 'def worth(%s):\n%s\n    return %s\n' % (
+            args, '\n'.join(self.lines), result)
+        exec source in self.env
+        worth = self.env['worth']
+        worth.source = source
+        worth.truncate = spec.truncate
+        return worth
+
 class Trunc(Specification):
     #Truncate the results before we calculate the policy
     def __init__(self, spec):
@@ -45,6 +135,42 @@ class Trunc(Specification):
         self.truncate = True
     def __call__(self, vec):
         return self.spec(vec)
+    def degree(self):
+        return self.spec.degree()
+    def key(self):
+        return self.spec.key()
+    def emit(self, compiler):
+        return compiler.node(self.spec)
+
+class CachedWorth:
+    #Remember the values of a spec (or compiled spec) for recently seen
+    #vectors. At most size vectors are kept, the least recently used go first
+    def __init__(self, spec, size):
+        self.spec = spec
+        self.size = size
+        self.truncate = spec.truncate
+        self.cache = dict() #dict<vector, [value, time last used]>
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+    def __call__(self, vec):
+        self.clock += 1
+        entry = self.cache.get(vec)
+        if entry is None:
+            self.misses += 1
+            if len(self.cache) >= self.size:
+                self.evict()
+            entry = self.cache[vec] = [self.spec(vec), self.clock]
+        else:
+            self.hits += 1
+            entry[1] = self.clock
+        return entry[0]
+    #Forget the least recently used half of the cache at once,
+    #which is cheaper than keeping the entries in order all the time
+    def evict(self):
+        order = sorted(self.cache, key=lambda vec: self.cache[vec][1])
+        for vec in order[:len(order) - self.size // 2]:
+            del self.cache[vec]
 
 class Lex(Specification):
     #Impose lexicographic ordering on a bunch of specs
@@ -52,6 +178,13 @@ class Lex(Specification):
         self.specs = specs
     def __call__(self, vec):
         return tuple(spec(vec) for spec in self.specs)
+    def key(self):
+        return ('Lex',) + tuple(spec.key() for spec in self.specs)
+    def emit(self, compiler):
+        names = [compiler.node(spec) for spec in self.specs]
+        if compiler.batch:
+            return 'numpy.column_stack((%s,))' % ', '.join(names)
+        return '(%s,)' % ', '.join(names)
 
 class ID(Specification):
     #Reference the kth identifier
@@ -59,6 +192,14 @@ class ID(Specification):
         self.k = k
     def __call__(self, vec):
         return vec[self.k]
+    def degree(self):
+        return 1
+    def key(self):
+        return ('ID', self.k)
+    def emit(self, compiler):
+        if compiler.batch:
+            return 'vecs[:, %d]' % self.k
+        return 'vec[%d]' % self.k
 
 class Num(Specification):
     #Constant
@@ -66,6 +207,14 @@ class Num(Specification):
         self.n = n
     def __call__(self, vec):
         return self.n
+    def degree(self):
+        return 0
+    def key(self):
+        return ('Num', type(self.n), self.n)
+    def emit(self, compiler):
+        if compiler.batch:
+            return '%s + zeros' % compiler.constant(self.n)
+        return compiler.constant(self.n)
 
 class Negate(Specification):
     #Negate the value
@@ -73,6 +222,12 @@ class Negate(Specification):
         self.spec = spec
     def __call__(self, vec):
         return -self.spec(vec)
+    def degree(self):
+        return self.spec.degree()
+    def key(self):
+        return ('Negate', self.spec.key())
+    def emit(self, compiler):
+        return '-%s' % compiler.node(self.spec)
 
 class Binop(Specification):
     #Binary operation on specifications
@@ -83,16 +238,32 @@ class Binop(Specification):
             right = Num(right)
         self.left = left
         self.right = right
+    def key(self):
+        return (self.__class__.__name__, self.left.key(), self.right.key())
 
 class Add(Binop):
     #Add two specifications
     def __call__(self, vec):
         return self.left(vec) + self.right(vec)
+    def degree(self):
+        left, right = self.left.degree(), self.right.degree()
+        if left is None or right is None:
+            return None
+        return max(left, right)
+    def emit(self, compiler):
+        return '%s + %s' % (compiler.node(self.left), compiler.node(self.right))
 
 class Mult(Binop):
     #Multiply two specifications
     def __call__(self, vec):
         return self.left(vec) * self.right(vec)
+    def degree(self):
+        left, right = self.left.degree(), self.right.degree()
+        if left is None or right is None or left + right > 1:
+            return None
+        return left + right
+    def emit(self, compiler):
+        return '%s * %s' % (compiler.node(self.left), compiler.node(self.right))
 
 class Gte(Binop):
     #Greater than or equal to specification
@@ -103,6 +274,14 @@ class Gte(Binop):
             lw = self.left(vec)
             rw = self.right(vec)
             return -abs(lw - rw)/math.sqrt(2) #distance to lw > rw
+    def degree(self): #piecewise, unless it compares constants
+        return 0 if self.left.degree() == self.right.degree() == 0 else None
+    def emit(self, compiler):
+        lw, rw = compiler.node(self.left), compiler.node(self.right)
+        if compiler.batch:
+            return 'numpy.where(%s >= %s, 0, -abs(%s - %s)/sqrt2)' % (
+                lw, rw, lw, rw)
+        return '0 if %s >= %s else -abs(%s - %s)/sqrt2' % (lw, rw, lw, rw)
 
 class Gt(Binop):
     #Greater than
@@ -113,4 +292,50 @@ class Gt(Binop):
             lw = self.left(vec)
             rw = self.right(vec)
             return -abs(lw - rw)/math.sqrt(2) - .1
+    def degree(self): #piecewise, unless it compares constants
+        return 0 if self.left.degree() == self.right.degree() == 0 else None
+    def emit(self, compiler):
+        lw, rw = compiler.node(self.left), compiler.node(self.right)
+        if compiler.batch:
+            return 'numpy.where(%s > %s, 0, -abs(%s - %s)/sqrt2 - .1)' % (
+                lw, rw, lw, rw)
+        return '0 if %s > %s else -abs(%s - %s)/sqrt2 - .1' % (lw, rw, lw, rw)
             
+
+
+#Weights of a linear spec, or of each term of a Lex of them, on k
+#objectives: row i of the (levels, k) array gives level i's coefficients
+#e.g. weights(Lex(ID(0), ID(0) - ID(1)), 2) is [[1, 0], [1, -1]]
+def weights(spec, k):
+    worth = spec.compile()
+    def levels(vec):
+        val = worth(tuple(vec))
+        return list(val) if isinstance(val, tuple) else [val]
+    origin = levels(numpy.zeros(k))
+    return numpy.array([[x - y for (x, y) in zip(levels(unit), origin)]
+                        for unit in numpy.eye(k)]).reshape(k, len(origin)).T
+
+#Classify a spec by the cheapest way to find its maximal values:
+# 'linear'    : affine in the reward vector
+# 'lexlinear' : Lex of affine terms
+# 'general'   : anything else (Gt, Gte, | and products of IDs)
+#For the first two the worth of a sum is the sum of the worths, so the
+#maximal set can be found one vector at a time (see ArrayValueIterator)
+#With k, the number of objectives, specs that give different vectors the
+#same worth (weights of rank below k, e.g. ID(0) on two objectives) are
+#general too: their maximal sets can hold several vectors
+def classify(spec, k=None):
+    while isinstance(spec, Trunc):
+        spec = spec.spec
+    if isinstance(spec, Lex):
+        if all(sp.degree() is not None for sp in spec.specs):
+            kind = 'lexlinear'
+        else:
+            return 'general'
+    elif spec.degree() is not None:
+        kind = 'linear'
+    else:
+        return 'general'
+    if k is not None and numpy.linalg.matrix_rank(weights(spec, k)) < k:
+        return 'general'
+    return kind
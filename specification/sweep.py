@@ -0,0 +1,157 @@
+#file: sweep.py
+#Solve a zoo model at every point of a parameter grid, spread over a pool
+#of processes, and stream one row of results per run as it finishes
+
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import time
+from collections import OrderedDict
+
+import zoo
+from solver import solve
+from valueIterator import ValueIterator, problemKey
+
+#Models that can be swept: name -> (structure builder, rewards builder,
+#parameters that only change probabilities, not which transitions exist)
+models = {
+    'hallway': (zoo.hallwayStructure, zoo.hallwayRewards, ('p',)),
+    'hallwaydoublestart': (zoo.hallwaydoublestartStructure,
+                           zoo.hallwayRewards, ('p',)),
+    'twohallway': (zoo.twohallwayStructure, zoo.hallwayRewards, ('p',)),
+    'ratioChoice': (zoo.ratioChoiceStructure, zoo.ratioRewards, ()),
+    'ratioChoiceSit': (zoo.ratioChoiceSitStructure, zoo.ratioRewards, ()),
+    'tgrid': (zoo.tgridStructure, zoo.tgridRewards, ('p',)),
+}
+
+#Columns after the parameters and policies in every row
+stats = ['backend', 'iterations', 'backups', 'residual', 'build seconds',
+         'solve seconds']
+
+#Every combination of the given parameter values, as dicts
+#e.g. grid(n=[2, 4], p=[.1, .3]) has four points
+def grid(**axes):
+    names = sorted(axes)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[axes[name] for name in names])]
+
+#The parameters of a point that decide which transitions exist
+def structureKey(model, params):
+    probabilities = models[model][2]
+    return sorted((name, val) for (name, val) in params.items()
+                  if name not in probabilities)
+
+#Last run of the current sweep in this process for each model:
+#dict<model, (key, CompiledStructure or None, reward function, result)>
+#Solving a model again with only its probabilities changed reuses the
+#index arrays and reward table rather than rebuilding them, and can
+#start from the last result. Only the array backend works on compiled
+#structures, so specs that go to the sets backend (see solve) just
+#reuse the reward function and the warm start.
+#This one is for pool workers, which forget() it as they start; a sweep
+#in this process passes runPoint a cache of its own.
+last = dict()
+
+#Pool initializer: start each worker with an empty cache, not one
+#inherited from whatever the parent swept before
+def forget():
+    last.clear()
+
+#A value as it can go in JSON, which has no infinity or NaN: those
+#(e.g. the residual of a run that stopped at runs) become null
+def jsonValue(val):
+    if isinstance(val, float) and (math.isinf(val) or math.isnan(val)):
+        return None
+    return val
+
+#Build and solve one point of a sweep, returning its row
+#task : (model, params, worth, states, warm, options) as made by sweep
+#cache : the last runs of this sweep, as for last
+def runPoint(task, cache=last):
+    model, params, worth, states, warm, options = task
+    structure, rewards = models[model][:2]
+    start = time.time()
+    ts = structure(**params)
+    key = structureKey(model, params)
+    if model in cache and cache[model][0] == key:
+        key, compiled, rfs, previous = cache[model]
+        if compiled is not None:
+            ts.compile(like=compiled)
+        gamma = options.get('gamma', ValueIterator.gamma)
+        if warm and previous.problem == problemKey(worth, rfs, gamma):
+            options = dict(options, warm=previous)
+    else:
+        rfs = rewards()
+    built = time.time()
+    result = solve(ts, rfs, worth, **options)
+    solved = time.time()
+    cache[model] = (key, ts.compiled, rfs, result)
+
+    row = dict(params)
+    for st in states:
+        row['policy %s' % (st,)] = ' '.join(sorted(str(act) for act
+                                                   in result.policy(st)))
+    row['backend'] = result.backend
+    row['iterations'] = result.iterations
+    row['backups'] = result.backups
+    row['residual'] = result.residual
+    row['build seconds'] = built - start
+    row['solve seconds'] = solved - built
+    return row
+
+#Solve model at every point and yield a row for each as it completes
+#(not in order when workers > 1)
+#model : name from models
+#points : list of parameter dicts, e.g. from grid
+#worth : spec to solve with
+#states : states whose policy goes in the rows
+#workers : processes to use (None: one per core, 1: this process only)
+#out : file to write the rows to as well, as 'csv' or 'json' (one
+#      object per line) according to format
+#warm : start each run from the last one with the same structure (best
+#       with a tolerance, and prioritized to redo only what changed)
+#options : passed to the solver
+def sweep(model, points, worth, states=(), workers=None, out=None,
+          format='csv', warm=False, **options):
+    assert model in models, "Unknown model %s" % model
+    assert format in ('csv', 'json'), "Unknown format %s" % format
+    #Points that only differ in probabilities go next to each other
+    points = sorted(points, key=lambda params: structureKey(model, params))
+    tasks = [(model, params, worth, tuple(states), warm, options)
+             for params in points]
+    if not tasks:
+        return
+    columns = sorted(points[0]) + ['policy %s' % (st,) for st in states] + \
+              stats
+    if out is not None and format == 'csv':
+        writer = csv.DictWriter(out, columns)
+        writer.writeheader()
+
+    pool = None
+    if workers == 1:
+        cache = dict() #gone with this sweep, along with its results
+        rows = (runPoint(task, cache) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(workers, forget)
+        #Keep runs of neighbouring points together so they share
+        #compiled structures
+        chunk = max(1, len(tasks) // (4 * (workers or
+                                            multiprocessing.cpu_count())))
+        rows = pool.imap_unordered(runPoint, tasks, chunk)
+    try:
+        for row in rows:
+            if out is not None:
+                if format == 'csv':
+                    writer.writerow(row)
+                else:
+                    out.write(json.dumps(OrderedDict(
+                        (name, jsonValue(row[name])) for name in columns),
+                        allow_nan=False) + '\n')
+                out.flush()
+            yield row
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
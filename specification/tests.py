@@ -1,9 +1,24 @@
 import unittest
 import random
 import math
+import os
+import multiprocessing
 from transitionStructure import *
+from compiledStructure import *
 from specification import *
 from valueIterator import *
+from arrayIterator import *
+from solver import *
+from policyIterator import *
+from vector import *
+from iterationStats import *
+import sweep
+import benchmark
+import zoo
+import StringIO
+import json
+import csv
+import logging
 
 class TransitionStructureTests(unittest.TestCase):
     def testConstructor_Functionality(self):
@@ -44,6 +59,91 @@ class TransitionStructureTests(unittest.TestCase):
         #Added action makes total probability invalid
         self.assertRaises(AssertionError, ts1.addAction, 0, 'a', {2: 1})
 
+    def testBulkLoad(self):
+        ts = TransitionStructure().build()
+        #Checking waits for freeze, so a half loaded action is fine
+        ts.addTransitions(zip([0, 0], ['a', 'a'], [1, 2], [.5, 0]))
+        ts.addTransitions((st, 'a', st + 1, 1) for st in range(1, 4))
+        ts.addAction(0, 'a', {3: .5})
+        ts.freeze()
+        self.assertEqual(ts.successors(0, 'a'), {1: .5, 3: .5})
+        self.assertEqual(ts.getStates(), set(range(5)))
+        self.assertEqual(ts.predecessors(3), {(0, 'a'), (2, 'a')})
+
+        ts.build()
+        ts.addTransitions([(4, 'a', 4, .7)])
+        self.assertRaises(AssertionError, ts.freeze)
+
+    def testBulkLoadZeros(self):
+        ts = TransitionStructure({(0, 'a', 1): 1, (1, 'a', 1): 1})
+        #A zero adds nothing, not even its states or action
+        ts.addTransitions([(1, 'b', 5, 0)])
+        self.assertEqual(ts.getStates(), {0, 1})
+        self.assertEqual(ts.getActions(1), {'a'})
+        self.assertEqual(PolicyIterator(ts, combineReward(lambda st: st),
+                                        ID(0)).policy(1), 'a')
+        #Zeros can remove transitions in the middle of a group
+        ts.addTransitions([(0, 'a', 2, .5), (0, 'a', 1, 0), (0, 'a', 3, .5)])
+        self.assertEqual(ts.successors(0, 'a'), {2: .5, 3: .5})
+        self.assertEqual(ts.predecessors(1), {(1, 'a')})
+        #or a whole action
+        ts.addTransitions([(0, 'a', 2, 0), (0, 'a', 3, 0)])
+        self.assertEqual(ts.getActions(0), set())
+        self.assertEqual(ts.getStates(), {1})
+        self.assertFalse((0, 'a', 2) in ts)
+        ts.compile()
+
+    def testReachable(self):
+        ts = TransitionStructure({
+            (0,'a',1): .5, (0,'a',2): .5, (1,'a',1): 1, (2,'b',0): 1,
+            (3,'a',0): 1, (4,'a',4): 1})
+        self.assertEqual(ts.reachable([0]), {0, 1, 2})
+        self.assertEqual(ts.reachable([3]), {0, 1, 2, 3})
+        self.assertEqual(ts.reachable([]), set())
+        sub = ts.restrict(ts.reachable([0]))
+        self.assertEqual(sub.getStates(), {0, 1, 2})
+        self.assertEqual(sub.successors(0, 'a'), {1: .5, 2: .5})
+        self.assertEqual(sub.getActions(3), set())
+
+    def testComponents(self):
+        ts = TransitionStructure({
+            (0,'a',1): 1, (1,'a',2): .5, (1,'a',0): .5, (2,'a',3): 1,
+            (3,'a',2): 1, (3,'b',4): 1, (5,'a',1): 1})
+        comps = ts.components()
+        self.assertEqual(sorted(sorted(comp) for comp in comps),
+                         [[0, 1], [2, 3], [4], [5]])
+        position = {st: i for (i, comp) in enumerate(comps) for st in comp}
+        #Every transition goes to the same or an earlier component
+        for (st, act, sp) in ts:
+            self.assertTrue(position[sp] <= position[st])
+        #Deep chains don't hit the recursion limit
+        chain = TransitionStructure().build()
+        chain.addTransitions((k, 'a', k + 1, 1) for k in range(5000))
+        self.assertEqual(len(chain.freeze().components()), 5001)
+
+    def testChangedSince(self):
+        ts = TransitionStructure({(0,'a',1): 1, (1,'a',1): 1})
+        self.assertEqual(ts.changedSince(0), {(0, 'a'), (1, 'a')})
+        vi = ValueIterator(ts, combineReward(lambda st: st), ID(0))
+        self.assertEqual(ts.changedSince(vi.edits), set())
+        ts.addAction(1, 'b', {0: 1})
+        ts[(0, 'a', 1)] = .5
+        ts[(0, 'a', 0)] = .5
+        self.assertEqual(ts.changedSince(vi.edits), {(0, 'a'), (1, 'b')})
+
+    def testTolerance(self):
+        ts = TransitionStructure().build()
+        ts.addAction(0, 'a', {0: .5, 1: .5 + 1e-6})
+        self.assertRaises(AssertionError, ts.freeze)
+        ts.freeze(tolerance=1e-5)
+        ts.validate(tolerance=1e-5)
+        #Solving part of it doesn't check it again at the default
+        ts.addAction(1, 'a', {1: 1})
+        rfs = combineReward(lambda st: st)
+        for Solver in (ValueIterator, ArrayValueIterator, PolicyIterator):
+            solved = Solver(ts, rfs, ID(0), initial=[0])
+            self.assertEqual(solved.ts.getStates(), {0, 1})
+
     def setUp(self):
         #Set up some sample transition structures for testing
         #ts_empty : Empty transition structure
@@ -116,6 +216,144 @@ class TransitionStructureTests(unittest.TestCase):
         self.assertEqual(self.ts_det_graph.getActions(4), {'a','b'})
         self.assertEqual(self.ts_sto_graph.getActions(3), {'a','b','c'})
 
+    def testSuccessors(self):
+        self.assertEqual(self.ts_empty.successors(0, 'a'), {})
+        self.assertEqual(self.ts_singleton.successors(0, 'a'), {1: 1})
+        self.assertEqual(self.ts_det_tree.successors(4, 'a'), {})
+        self.assertEqual(self.ts_sto_dag.successors(2, 'b'), {1: .5, 5: .5})
+        self.assertEqual(self.ts_sto_graph.successors(3, 'b'), {5: .8, 3: .2})
+
+    def testPredecessors(self):
+        self.assertEqual(self.ts_empty.predecessors(0), set([]))
+        self.assertEqual(self.ts_singleton.predecessors(1), {(0, 'a')})
+        self.assertEqual(self.ts_det_tree.predecessors(0), set([]))
+        self.assertEqual(self.ts_det_dag.predecessors(6),
+                         {(3, 'a'), (4, 'a'), (5, 'b')})
+        self.assertEqual(self.ts_sto_graph.predecessors(4),
+                         {(2, 'a'), (5, 'a'), (5, 'b'), (6, 'a')})
+
+    def testLookupDoesNotInsert(self):
+        ts = TransitionStructure({(0, 'a', 1): 1, (1, 'a', 1): 1})
+        self.assertEqual(ts[(0, 'a', 0)], 0)
+        self.assertEqual(ts.probability(0, 'a', 0), 0)
+        self.assertEqual(ts.probability(0, 'a', 1), 1)
+        self.assertEqual(ts, {(0, 'a', 1): 1, (1, 'a', 1): 1})
+        ValueIterator(ts, combineReward(lambda st: st), ID(0))
+        self.assertEqual(len(ts), 2)
+
+    def testIndexesFollowAddAction(self):
+        ts = TransitionStructure({(0, 'a', 1): 1})
+        ts.addAction(1, 'b', {2: .5, 0: .5})
+        self.assertEqual(ts.getStates(), {0, 1, 2})
+        self.assertEqual(ts.getActions(1), {'b'})
+        self.assertEqual(ts.successors(1, 'b'), {2: .5, 0: .5})
+        self.assertEqual(ts.predecessors(0), {(1, 'b')})
+
+    def testIndexesFollowDictMethods(self):
+        ts = TransitionStructure({(0, 'a', 1): 1})
+        ts.update({(1, 'a', 1): 1})
+        self.assertEqual(ts.getActions(1), {'a'})
+        self.assertEqual(ts.setdefault((1, 'a', 1), .5), 1)
+        self.assertEqual(ts.setdefault((2, 'a', 2), 1), 1)
+        self.assertEqual(ts.getStates(), {0, 1, 2})
+        del ts[(0, 'a', 1)]
+        self.assertEqual(ts.successors(0, 'a'), {})
+        self.assertEqual(ts.getActions(0), set())
+        self.assertEqual(ts.getStates(), {1, 2})
+        self.assertEqual(ts.predecessors(1), {(1, 'a')})
+        self.assertEqual(ts.pop((2, 'a', 2)), 1)
+        self.assertEqual(ts.pop((2, 'a', 2), None), None)
+        self.assertRaises(KeyError, ts.pop, (2, 'a', 2))
+        self.assertEqual(ts.getStates(), {1})
+        self.assertEqual(ts.popitem(), ((1, 'a', 1), 1))
+        self.assertEqual(ts.getStates(), set())
+        ts.update({(0, 'a', 1): 1, (1, 'a', 0): 1})
+        ts.clear()
+        self.assertEqual((ts, ts.getStates(), ts.predecessors(0)),
+                         ({}, set(), set()))
+
+    def testZeroRemoves(self):
+        ts = TransitionStructure({(0, 'a', 1): 1, (1, 'a', 1): 1})
+        ts[(1, 'a', 5)] = 0 #nothing to remove
+        self.assertEqual(ts, {(0, 'a', 1): 1, (1, 'a', 1): 1})
+        self.assertEqual(ts.getStates(), {0, 1})
+        ts[(1, 'a', 0)] = .5
+        ts[(1, 'a', 1)] = .5
+        ts[(1, 'a', 0)] = 0
+        self.assertEqual(ts.successors(1, 'a'), {1: .5})
+        self.assertFalse((1, 'a', 0) in ts)
+        self.assertEqual(ts.predecessors(0), set())
+        ts[(1, 'a', 1)] = 1
+        ts[(0, 'a', 1)] = 0 #0 has nothing left, but 1 still leads to itself
+        self.assertEqual(ts.getStates(), {1})
+        self.assertEqual(ts.getActions(0), set())
+        self.assertEqual(ts.compile().numStates(), 1)
+
+
+class CompiledStructureTests(unittest.TestCase):
+    def setUp(self):
+        self.ts = TransitionStructure({
+            (0,'a',1): .3, (0,'a',2): .7, (0,'b',2): 1,
+            (1,'a',1): 1, (2,'a',0): .5, (2,'a',2): .5})
+
+    def testArrays(self):
+        cs = self.ts.compile()
+        self.assertEqual(cs.numStates(), 3)
+        self.assertEqual(cs.numRows(), 4)
+        self.assertEqual(list(cs.indptr)[-1], 6)
+        for row, (st, act) in enumerate(cs.rows):
+            self.assertEqual(cs.states[cs.rowState[row]], st)
+            self.assertEqual(cs.actions[cs.rowAction[row]], act)
+            dist = {cs.states[cs.indices[i]]: cs.probs[i]
+                    for i in range(cs.indptr[row], cs.indptr[row + 1])}
+            self.assertEqual(dist, self.ts.successors(st, act))
+        self.assertEqual({cs.rows[r] for r in cs.rowsOf(0)},
+                         {(0, 'a'), (0, 'b')})
+
+    def testExpect(self):
+        cs = self.ts.compile()
+        V = [10.0 * (cs.states[i] + 1) for i in range(cs.numStates())]
+        E = cs.expect(V)
+        self.assertAlmostEqual(E[cs.rowIds[(0, 'a')]], 6 + 21)
+        self.assertAlmostEqual(E[cs.rowIds[(2, 'a')]], 5 + 15)
+        E2 = cs.expect([[v, -v] for v in V])
+        self.assertAlmostEqual(E2[cs.rowIds[(0, 'b')]][1], -30)
+
+    def testCache(self):
+        cs = self.ts.compile()
+        self.assertTrue(self.ts.compile() is cs)
+        self.ts.addAction(3, 'a', {3: 1})
+        self.assertFalse(self.ts.compile() is cs)
+        self.assertEqual(self.ts.compile().numStates(), 4)
+
+    def testReuse(self):
+        cs = self.ts.compile()
+        other = TransitionStructure({
+            (0,'a',1): .6, (0,'a',2): .4, (0,'b',2): 1,
+            (1,'a',1): 1, (2,'a',0): .1, (2,'a',2): .9})
+        reused = other.compile(like=cs)
+        self.assertTrue(reused.indptr is cs.indptr)
+        self.assertEqual(reused.rewardTables, cs.rewardTables)
+        fresh = CompiledStructure(other)
+        V = [1.0, 2.0, 4.0]
+        for row, (st, act) in enumerate(fresh.rows):
+            self.assertEqual(fresh.expect([V[fresh.stateIds[sp]]
+                                           for sp in fresh.states])[row],
+                             reused.expect([V[reused.stateIds[sp]]
+                                            for sp in reused.states])
+                             [reused.rowIds[(st, act)]])
+        #A different set of transitions can't be reused
+        other.addAction(1, 'b', {0: 1})
+        self.assertTrue(cs.reuse(other) is None)
+        self.assertFalse(other.compile(like=cs).indptr is cs.indptr)
+
+    def testSelect(self):
+        cs = self.ts.compile()
+        rows = [cs.rowIds[(2, 'a')], cs.rowIds[(0, 'b')]]
+        P = cs.select(rows)
+        self.assertEqual(P.shape, (2, 3))
+        V = [1.0, 2.0, 4.0]
+        self.assertEqual(list(P.dot(V)), list(cs.expect(V)[rows]))
 
 class SpecificationTests(unittest.TestCase):
     def testCombineReward(self):
@@ -126,6 +364,22 @@ class SpecificationTests(unittest.TestCase):
         self.assertEqual(combineReward(rf1, rf2, rf3, rf4)(0), (3, 0, 0, 2))
         self.assertEqual(combineReward(rf2, rf3, rf1, rf4)(2), (2, 4, 3, 4))
         self.assertEqual(combineReward(rf1)(5), (3,))
+    def testRewardTable(self):
+        calls = []
+        def rf(st):
+            calls.append(st)
+            return st * 2
+        states = [3, 1, 2]
+        table = rewardTable(combineReward(rf, lambda st: -st), states)
+        self.assertEqual(table.tolist(), [[6, -3], [2, -1], [4, -2]])
+        self.assertEqual(calls, states)
+        batched = batchReward(rf, lambda sts: [10 * st for st in sts])
+        self.assertEqual(batched(4), 8)
+        table = rewardTable(combineReward(batched, rf), states)
+        self.assertEqual(table.tolist(), [[30, 6], [10, 2], [20, 4]])
+        self.assertEqual(rewardTable(lambda st: (st, 1), [5]).tolist(),
+                         [[5, 1]])
+        self.assertEqual(rewardTable(combineReward(rf, rf), []).shape, (0, 2))
     def testNum(self):
         for n in random.sample(range(100), 20):
             self.assertEqual(Num(n)(0), n)
@@ -162,6 +416,73 @@ class SpecificationTests(unittest.TestCase):
         self.assertEqual(Gt(Num(10),Num(8))(vec), 0)
         self.assertEqual(Gt(Num(10.00001),Num(10))(vec), 0)
         self.assertAlmostEqual(Gt(Num(-2),Num(0))(vec), -math.sqrt(2)-.1)
+    def testCompile(self):
+        A, B, C = ID(0), ID(1), ID(2)
+        class Opaque(Specification):
+            def __call__(self, vec):
+                return vec[0] * vec[2]
+        specs = [A, Num(3), -B, A + B * 2, A - B, A | B, (A > 0) + (B > 0),
+                 A >= C, Lex(A > 0, -B), Trunc(Lex(A, B, C)),
+                 Lex(Opaque(), (A | B) - C)]
+        vecs = [(0, 0, 0), (1, 0, 2), (-1.5, 2, .25), (3, 3, -3),
+                (.1 + .2, .3, 7)]
+        for spec in specs:
+            worth = spec.compile()
+            batch = spec.compile(batch=True)
+            values = batch(vecs)
+            for i, vec in enumerate(vecs):
+                self.assertEqual(worth(vec), spec(vec))
+                expected = spec(vec)
+                if isinstance(expected, tuple):
+                    self.assertEqual(tuple(values[i]), expected)
+                else:
+                    self.assertEqual(values[i], expected)
+    def testCompileSharesSubtrees(self):
+        A, B = ID(0), ID(1)
+        source = (A | B).compile().source
+        self.assertEqual(source.count('vec[0]'), 1)
+        self.assertEqual(source.count('vec[1]'), 1)
+        self.assertEqual(source.count('>='), 2) #Gte(B, A) and Gte(A, B)
+        source = ((A + B) * (A + B)).compile().source
+        self.assertEqual(source.count('+'), 1)
+    def testClassify(self):
+        A, B = ID(0), ID(1)
+        self.assertEqual(classify(A), 'linear')
+        self.assertEqual(classify(A * 2 - B + 3), 'linear')
+        self.assertEqual(classify(Num(2) * (A + B)), 'linear')
+        self.assertEqual(classify(Trunc(-A)), 'linear')
+        self.assertEqual(classify(Lex(A, B * 3 - A)), 'lexlinear')
+        self.assertEqual(classify(Trunc(Lex(A, Num(1) > Num(0)))), 'lexlinear')
+        self.assertEqual(classify(A * B), 'general')
+        self.assertEqual(classify(A > 0), 'general')
+        self.assertEqual(classify(A | B), 'general')
+        self.assertEqual(classify(Lex(A > 0, -B)), 'general')
+        self.assertEqual(classify(A + Lex(A)), 'general')
+        #Given the number of objectives, only specs that tell every
+        #vector apart hold one vector per maximal set
+        self.assertEqual(classify(A * 2 + 3, 1), 'linear')
+        self.assertEqual(classify(A - B, 2), 'general')
+        self.assertEqual(classify(Lex(A, B * 3 - A), 2), 'lexlinear')
+        self.assertEqual(classify(Lex(A, A * 2), 2), 'general')
+        self.assertEqual(classify(A > 0, 1), 'general')
+        self.assertEqual(weights(Lex(A, A - B), 2).tolist(), [[1, 0], [1, -1]])
+    def testCachedWorth(self):
+        calls = []
+        class Counted(Specification):
+            def __call__(self, vec):
+                calls.append(vec)
+                return vec[0]
+        worth = CachedWorth(Counted(), 2)
+        self.assertEqual([worth(v) for v in [(1,), (2,), (1,), (3,)]],
+                         [1, 2, 1, 3])
+        self.assertEqual((worth.hits, worth.misses), (1, 3))
+        worth((1,)) #still cached, (2,) was least recently used
+        worth((2,))
+        self.assertEqual(calls, [(1,), (2,), (3,), (2,)])
+        self.assertTrue(len(worth.cache) <= 2)
+        self.assertFalse(worth.truncate)
+        self.assertTrue(CachedWorth(Trunc(ID(0)), 2).truncate)
+        self.assertTrue(CachedWorth(Trunc(ID(0)).compile(), 2).truncate)
     def testLexicographic(self):
         vec = (0, 1, 2, 3)
         self.assertEqual(Lex(ID(0),ID(1),ID(2),ID(3))(vec), vec)
@@ -200,6 +521,135 @@ class ValueIteratorTests(unittest.TestCase):
         self.assertEqual(union([{0},{0},{0}]), {0})
         self.assertEqual(union([{0},{1},{0,1},{0}]), {0,1})
         self.assertEqual(union([{'a','b'},{'a'},{'c'}]),{'a','b','c'})
+    def testMax(self):
+        vi = ValueIterator(TransitionStructure(), combineReward(), ID(0),
+                           runs=0)
+        self.assertEqual(vi.max(set([])), set([]))
+        self.assertEqual(vi.max({(1, 0), (3, 0), (2, 5)}), {(3, 0)})
+        self.assertEqual(vi.max({(3, 1), (3, 0), (2, 5)}), {(3, 1), (3, 0)})
+        vi.worth = Lex(ID(0), -ID(1))
+        self.assertEqual(vi.max({(3, 1), (3, 0), (2, 5)}), {(3, 0)})
+        vi.worth = Gte(ID(0), ID(1))
+        self.assertEqual(vi.max({(3, 1), (3, 0), (2, 5), (1, 2)}),
+                         {(3, 1), (3, 0)})
+    def testHausdorff(self):
+        self.assertEqual(hausdorff(set([]), set([])), 0)
+        self.assertEqual(hausdorff({(1, 2)}, {(1, 2)}), 0)
+        self.assertEqual(hausdorff({(0, 0)}, set([])), float('inf'))
+        self.assertEqual(hausdorff({(0, 0)}, {(1, -3)}), 3)
+        self.assertEqual(hausdorff({(0,), (10,)}, {(1,)}), 9)
+        self.assertEqual(hausdorff({(0,), (10,)}, {(1,), (10,)}), 1)
+    def testConvergence(self):
+        ts = TransitionStructure({(0,'a',0): .5, (0,'a',1): .5,
+                                  (1,'a',0): 1, (1,'b',1): 1})
+        rfs = combineReward(lambda st: st)
+        vi = ValueIterator(ts, rfs, ID(0))
+        self.assertEqual(vi.iterations, vi.runs)
+        vi0 = ValueIterator(ts, rfs, ID(0), tolerance=1e-4)
+        self.assertTrue(vi0.iterations < vi.runs)
+        self.assertTrue(vi0.residual <= 1e-4)
+        vi1 = ValueIterator(ts, rfs, ID(0), tolerance=1e-4, inPlace=True)
+        self.assertTrue(vi1.iterations <= vi0.iterations)
+        for key in vi.Q:
+            self.assertAlmostEqual(list(vi0.Q[key])[0][0],
+                                   list(vi.Q[key])[0][0], places=2)
+            self.assertAlmostEqual(list(vi1.Q[key])[0][0],
+                                   list(vi.Q[key])[0][0], places=2)
+        self.assertEqual(vi1.policy(1), {'b'})
+        self.assertRaises(AssertionError, ValueIterator, ts, rfs, ID(0),
+                          tolerence=1e-4)
+        self.assertRaises(AssertionError, ValueIterator, ts, rfs, ID(0),
+                          update=None) #a method, not an option
+        #Only the final sweep is measured, but it gives the same residual
+        measured = ValueIterator(ts, rfs, ID(0), observer=lambda stats: None)
+        self.assertEqual(vi.residual, measured.residual)
+        self.assertEqual(ValueIterator(ts, rfs, ID(0), scc=True).residual,
+                         ValueIterator(ts, rfs, ID(0), scc=True,
+                                       observer=lambda stats: None).residual)
+        self.assertRaises(AssertionError, ValueIterator, ts, rfs, ID(0),
+                          backend='array') #describes the solver
+        self.assertFalse('backend' in ValueIterator.options())
+    def testImmutableValues(self):
+        ts = TransitionStructure({(0,'a',1): 1, (1,'a',0): .5, (1,'a',1): .5})
+        vi = ValueIterator(ts, combineReward(lambda st: st), ID(0), runs=3)
+        self.assertEqual(vi.iterations, 3)
+        for val in vi.Q.values():
+            self.assertTrue(isinstance(val, frozenset))
+    def testDominance(self):
+        ts = TransitionStructure({
+            (0,'a',1): .5, (0,'a',2): .5, (0,'b',2): 1,
+            (1,'a',0): 1, (1,'b',2): 1,
+            (2,'a',0): .5, (2,'a',1): .5, (2,'b',2): 1})
+        rfs = combineReward(lambda st: 1 if st == 1 else 0,
+                            lambda st: 1 if st == 2 else 0)
+        worth = Gte(ID(0), ID(1) * .5)
+        vi = ValueIterator(ts, rfs, worth, runs=6)
+        vid = ValueIterator(ts, rfs, worth, runs=6, dominance=True)
+        for key in vi.Q:
+            self.assertEqual(vid.Q[key], vi.max(vi.Q[key]))
+        for st in ts.getStates():
+            self.assertEqual(vid.policy(st), vi.policy(st))
+        viq = ValueIterator(ts, rfs, worth, runs=6, quantum=1e-9)
+        for key in vi.Q:
+            self.assertTrue(len(viq.Q[key]) <= len(vi.Q[key]))
+            self.assertTrue(hausdorff(viq.Q[key], vi.Q[key]) <
+                            viq.errorBound() + 1e-12)
+    def testThin(self):
+        vi = ValueIterator(TransitionStructure(), combineReward(), ID(0),
+                           runs=0, cover=.1)
+        self.assertEqual(vi.thin({(0, 0), (.05, 0), (0, .3)}),
+                         {(0, 0), (0, .3)})
+        self.assertAlmostEqual(vi.pruneError, .05)
+        vi.cover, vi.cap = None, 2
+        self.assertEqual(vi.thin({(0, 0), (1, 1)}), {(0, 0), (1, 1)})
+        self.assertEqual(vi.thin({(0, 0), (.1, .1), (1, 1)}), {(0, 0), (1, 1)})
+        self.assertAlmostEqual(vi.pruneError, .1)
+        self.assertAlmostEqual(vi.errorBound(), .1 / (1 - vi.gamma))
+    def testMerge(self):
+        vi = ValueIterator(TransitionStructure(), combineReward(), ID(0),
+                           runs=0, quantum=1e-6)
+        noisy = {(.1 + .2, 1.0), (.3, 1.0), (.3, 1.1)}
+        self.assertEqual(len(noisy), 3)
+        self.assertEqual(vi.merge(noisy), {(.3, 1.0), (.3, 1.1)})
+        self.assertTrue(0 < vi.pruneError < 1e-6)
+        vi.quantum = None
+        self.assertEqual(vi.merge(noisy), noisy)
+    def testRewardsEvaluatedOnce(self):
+        calls = []
+        def rf(st):
+            calls.append(st)
+            return st
+        ts = TransitionStructure({(0,'a',1): 1, (1,'a',0): .5, (1,'a',1): .5})
+        ValueIterator(ts, combineReward(rf), ID(0), runs=10)
+        self.assertEqual(sorted(calls), [0, 1])
+    def testPlainWorth(self):
+        #A worth that isn't a Specification is called as it is
+        ts = TransitionStructure({(0,'a',1): 1, (0,'b',0): 1, (1,'a',1): 1})
+        rfs = combineReward(lambda st: st, lambda st: 1 - st)
+        def worth(vec):
+            return vec[0] - vec[1]
+        worth.truncate = False
+        vi = ValueIterator(ts, rfs, worth)
+        spec = ValueIterator(ts, rfs, ID(0) - ID(1))
+        self.assertEqual(dict(vi.Q), dict(spec.Q))
+        self.assertEqual(vi.policy(0), {'a'})
+        self.assertEqual(PolicyIterator(ts, rfs, worth).policy(0), 'a')
+    def testWorthCache(self):
+        ts = TransitionStructure({(0,'a',1): .5, (0,'a',2): .5, (0,'b',0): 1,
+                                  (1,'a',0): 1, (2,'a',2): 1})
+        rfs = combineReward(lambda st: 1 if st == 2 else 0,
+                            lambda st: 1 if st == 1 else 0)
+        worth = Gt(ID(0), ID(1))
+        vi = ValueIterator(ts, rfs, worth, runs=10)
+        vin = ValueIterator(ts, rfs, worth, runs=10, cacheSize=0)
+        self.assertEqual(dict(vi.Q), dict(vin.Q))
+        hits, misses = vi.cacheStats()
+        self.assertTrue(hits > 0 and misses > 0)
+        #max scores each value once and skips lone values, so the misses
+        #are the distinct vectors and every other worth call is a hit
+        self.assertEqual(misses, len(vi.worth.cache))
+        self.assertEqual(hits + misses, vi.worthCalls)
+        self.assertEqual(vin.cacheStats(), (0, 0))
     def testConstructorBasic(self):
         ts0 = TransitionStructure({(0, 'a', 1): 1})
         rfs0 = combineReward(lambda st: st)
@@ -261,6 +711,688 @@ class ValueIteratorTests(unittest.TestCase):
                                        
         
     
+#Q of a small model solved with ArrayValueIterator (see testWorkersInPool)
+def solveInPool(workers):
+    ts = TransitionStructure({(0,'a',1): 1, (1,'a',0): .5, (1,'a',1): .5,
+                              (1,'b',2): 1, (2,'a',2): 1})
+    rfs = combineReward(lambda st: st, lambda st: -st)
+    avi = ArrayValueIterator(ts, rfs, Lex(ID(0), ID(1)), workers=workers)
+    return dict(avi.Q)
+
+class ArrayValueIteratorTests(unittest.TestCase):
+    def setUp(self):
+        self.ts = TransitionStructure({
+            (0,'a',1): .3, (0,'a',2): .7, (0,'b',2): 1,
+            (1,'a',3): 1, (1,'b',0): .5, (1,'b',2): .5,
+            (2,'a',2): .4, (2,'a',0): .6, (3,'a',3): 1})
+        self.rfs = combineReward(lambda st: 1 if st == 1 else 0,
+                                 lambda st: st * .5)
+
+    def assertSameAsValueIterator(self, ts, rfs, worth):
+        vi = ValueIterator(ts, rfs, worth)
+        avi = ArrayValueIterator(ts, rfs, worth)
+        self.assertEqual(dict(vi.Q), avi.Q)
+        for st in ts.getStates():
+            self.assertEqual(vi.policy(st), avi.policy(st))
+
+    def testMatchesValueIterator(self):
+        single = combineReward(lambda st: 1 if st == 1 else st * .5)
+        self.assertSameAsValueIterator(self.ts, single, ID(0))
+        self.assertSameAsValueIterator(self.ts, single, -ID(0) * 2 + 1)
+        self.assertSameAsValueIterator(self.ts, self.rfs, Lex(ID(0), -ID(1)))
+        self.assertSameAsValueIterator(self.ts, self.rfs,
+                                       Lex(ID(1) - ID(0) * 3, ID(0)))
+        self.assertSameAsValueIterator(self.ts, self.rfs,
+                                       Trunc(Lex(-ID(1), ID(0))))
+
+    def testDeadEnd(self):
+        #State 1 has no actions so nothing leading there has a value
+        ts = TransitionStructure({(0,'a',1): 1, (0,'b',0): 1})
+        rfs = combineReward(lambda st: st)
+        avi = ArrayValueIterator(ts, rfs, ID(0))
+        self.assertEqual(avi.Q, {(0,'a'): set([]), (0,'b'): {(0,)}})
+        self.assertEqual(avi.policy(0), {'b'})
+        self.assertEqual(avi.policy(1), set([]))
+
+    def testConvergence(self):
+        avi = ArrayValueIterator(self.ts, self.rfs, Lex(ID(0), -ID(1)),
+                                 tolerance=1e-3)
+        self.assertTrue(avi.iterations < avi.runs)
+        self.assertTrue(avi.residual <= 1e-3)
+        full = ArrayValueIterator(self.ts, self.rfs, Lex(ID(0), -ID(1)))
+        for st in self.ts.getStates():
+            self.assertEqual(avi.policy(st), full.policy(st))
+        measured = ArrayValueIterator(self.ts, self.rfs, Lex(ID(0), -ID(1)),
+                                      observer=lambda stats: None)
+        self.assertEqual(full.residual, measured.residual) #the final sweep
+        parallel = ArrayValueIterator(self.ts, self.rfs, Lex(ID(0), -ID(1)),
+                                      workers=2)
+        self.assertEqual(parallel.residual, full.residual)
+        self.assertRaises(ValueError, ArrayValueIterator, self.ts, self.rfs,
+                          ID(0), inPlace=True)
+
+    def testSolve(self):
+        vi = solve(self.ts, self.rfs, Lex(ID(0), -ID(1)))
+        self.assertEqual((vi.kind, vi.backend), ('lexlinear', 'array'))
+        single = combineReward(lambda st: 1 if st == 1 else st * .5)
+        vi = solve(self.ts, single, -ID(0) * 2 + 1)
+        self.assertEqual((vi.kind, vi.backend), ('linear', 'array'))
+        vi = solve(self.ts, single, ID(0), inPlace=True)
+        self.assertEqual((vi.kind, vi.backend), ('linear', 'sets'))
+        vi = solve(self.ts, self.rfs, Gt(ID(0), ID(1)), runs=5)
+        self.assertEqual((vi.kind, vi.backend), ('general', 'sets'))
+        self.assertEqual(vi.iterations, 5)
+
+    def testTies(self):
+        #ID(0) can't tell (1, 0) from (1, 1), so the maximal set of
+        #(0, 'a') holds both and solve has to keep Q as sets
+        ts = TransitionStructure({(0,'a',1): 1, (1,'x',2): 1, (1,'y',3): 1,
+                                  (2,'a',2): 1, (3,'a',3): 1})
+        rfs = combineReward(lambda st: 1 if st > 1 else 0,
+                            lambda st: 1 if st == 3 else 0)
+        for worth in (ID(0), ID(0) - ID(1) * 2 + 1, Lex(ID(0), ID(0))):
+            vi = ValueIterator(ts, rfs, worth)
+            solved = solve(ts, rfs, worth)
+            self.assertEqual((solved.kind, solved.backend), ('general', 'sets'))
+            self.assertEqual(dict(solved.Q), dict(vi.Q))
+        self.assertEqual(len(solved.Q[(0, 'a')]), 2)
+        for worth in (ID(0), Lex(ID(0), ID(0))):
+            self.assertRaises(ValueError, ArrayValueIterator, ts, rfs, worth)
+
+    def testMissingKeys(self):
+        worth = Lex(ID(0), -ID(1))
+        vi = ValueIterator(self.ts, self.rfs, worth)
+        avi = ArrayValueIterator(self.ts, self.rfs, worth)
+        self.assertEqual(avi.Q[(9, 'z')], vi.Q[(9, 'z')])
+
+    def testNonlinear(self):
+        self.assertRaises(ValueError, ArrayValueIterator,
+                          self.ts, self.rfs, Gt(ID(0), ID(1)))
+        self.assertRaises(ValueError, ArrayValueIterator,
+                          self.ts, self.rfs, Mult(ID(0), ID(1)))
+
+    def testWorkers(self):
+        #State 4 has no actions, so its value is missing (NaN)
+        self.ts.addAction(3, 'b', {4: 1})
+        X, Y = ID(0), ID(1)
+        for worth in (Lex(X + Y, Y), Lex(X, -Y)):
+            serial = ArrayValueIterator(self.ts, self.rfs, worth)
+            for workers in (2, 3, 10):
+                parallel = ArrayValueIterator(self.ts, self.rfs, worth,
+                                              workers=workers)
+                numpy.testing.assert_array_equal(serial.Qa, parallel.Qa)
+                self.assertEqual(serial.Q, parallel.Q)
+                self.assertEqual(serial.iterations, parallel.iterations)
+        #The sets backend ignores workers, and says so
+        G, W = ID(0), ID(1)
+        out = StringIO.StringIO()
+        handler = logging.StreamHandler(out)
+        logger = logging.getLogger('specification')
+        logger.addHandler(handler)
+        try:
+            for worth in (Lex(G > 0, -W), X >= Y):
+                serial = solve(self.ts, self.rfs, worth)
+                parallel = solve(self.ts, self.rfs, worth, workers=2)
+                self.assertEqual(parallel.backend, 'sets')
+                self.assertEqual(serial.Q, parallel.Q)
+            self.assertEqual(zoo.hallway(4, .3, Lex(G > 0, -W),
+                                         workers=2).backend, 'sets')
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(out.getvalue().count("workers only applies"), 3)
+
+    def testWorkerFailures(self):
+        worth = Lex(ID(0), ID(1))
+        class Failing(ArrayValueIterator):
+            def worker(self, conn, *args):
+                conn.recv()
+                conn.send('Traceback: failed')
+        class Dying(ArrayValueIterator):
+            def worker(self, conn, *args):
+                os._exit(3)
+        for Solver in (Failing, Dying):
+            self.assertRaises(RuntimeError, Solver, self.ts, self.rfs, worth,
+                              workers=2)
+        try:
+            Dying(self.ts, self.rfs, worth, workers=2)
+        except RuntimeError as error:
+            self.assertTrue('exited with code 3' in str(error))
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def testWorkersInPool(self):
+        #Pool workers are daemonic and can't start workers of their own
+        pool = multiprocessing.Pool(1)
+        try:
+            Q = pool.apply(solveInPool, (2,))
+        finally:
+            pool.terminate()
+            pool.join()
+        self.assertEqual(Q, solveInPool(1))
+
+    def testPartition(self):
+        avi = ArrayValueIterator(self.ts, self.rfs, Lex(ID(0), ID(1)))
+        for count in (1, 2, 4, 8):
+            blocks = avi.partition(count)
+            self.assertTrue(len(blocks) <= count)
+            self.assertEqual(blocks[0][0], 0)
+            self.assertEqual(blocks[-1][1], avi.cs.numStates())
+            for (first, last), (nextFirst, nextLast) in zip(blocks,
+                                                            blocks[1:]):
+                self.assertTrue(first < last == nextFirst)
+
+
+class ComponentTests(unittest.TestCase):
+    def testMatchesSweeps(self):
+        #A chain into a two state loop
+        ts = TransitionStructure().build()
+        ts.addTransitions((k, 'a', k + 1, 1) for k in range(10))
+        ts.addAction(10, 'a', {10: .5, 11: .5})
+        ts.addAction(11, 'a', {10: 1})
+        ts.addAction(11, 'b', {11: 1})
+        ts.freeze()
+        rfs = combineReward(lambda st: 1 if st == 11 else 0,
+                            lambda st: -st)
+        G, W = ID(0), ID(1)
+        for worth in (Lex(G, W), Lex(G > 0, W)):
+            sweeps = ValueIterator(ts, rfs, worth, tolerance=1e-12, runs=1000)
+            comps = ValueIterator(ts, rfs, worth, tolerance=1e-12, runs=1000,
+                                  scc=True)
+            for key in sweeps.Q:
+                self.assertTrue(hausdorff(sweeps.Q[key], comps.Q[key]) < 1e-9)
+            #The chain takes one backup per state
+            self.assertEqual(comps.backups, 10 + 3 * comps.iterations)
+            self.assertTrue(comps.backups < sweeps.backups)
+
+    def testSolverChoice(self):
+        ts = TransitionStructure({(0,'a',0): 1})
+        rfs = combineReward(lambda st: 1)
+        self.assertEqual(solve(ts, rfs, ID(0), scc=True).backend, 'sets')
+        self.assertRaises(ValueError, ArrayValueIterator, ts, rfs, ID(0),
+                          scc=True)
+
+class PrioritizedSweepingTests(unittest.TestCase):
+    def setUp(self):
+        #A long corridor leading to a loop with the only reward
+        self.ts = TransitionStructure().build()
+        self.ts.addTransitions((k, 'a', k + 1, 1) for k in range(30))
+        self.ts.addTransitions((k, 'b', k, 1) for k in range(30))
+        self.ts.addAction(30, 'a', {30: .5, 31: .5})
+        self.ts.addAction(31, 'a', {30: 1})
+        self.ts.freeze()
+        self.rfs = combineReward(lambda st: 1 if st == 31 else 0,
+                                 lambda st: -1)
+
+    def testMatchesSweeps(self):
+        G, C = ID(0), ID(1)
+        for worth in (Lex(G, C), Lex(G > 1, C)):
+            sweeps = ValueIterator(self.ts, self.rfs, worth, runs=1000,
+                                   tolerance=1e-10)
+            queued = ValueIterator(self.ts, self.rfs, worth, runs=1000,
+                                   tolerance=1e-10, prioritized=True)
+            self.assertTrue(queued.backups < .7 * sweeps.backups)
+            self.assertTrue(0 < queued.residual <= 1e-10)
+            self.assertTrue(queued.converged())
+            self.assertEqual(queued.policy(0), {'a'})
+            if classify(worth) == 'general':
+                continue #which values tie depends on the order of updates
+            for key in sweeps.Q:
+                self.assertTrue(hausdorff(sweeps.Q[key], queued.Q[key]) < 1e-8)
+            for st in self.ts.getStates():
+                self.assertEqual(sweeps.policy(st), queued.policy(st))
+
+    def testBudget(self):
+        vi = ValueIterator(self.ts, self.rfs, ID(0), runs=2, prioritized=True)
+        self.assertEqual(vi.backups, 2 * 62)
+        self.assertTrue(vi.residual > 0)
+        self.assertRaises(ValueError, ValueIterator, self.ts, self.rfs, ID(0),
+                          prioritized=True, scc=True)
+        self.assertEqual(solve(self.ts, self.rfs, ID(0),
+                               prioritized=True).backend, 'sets')
+
+class WarmStartTests(unittest.TestCase):
+    def setUp(self):
+        #A corridor where only the far end is worth anything
+        self.ts = TransitionStructure().build()
+        self.ts.addTransitions((k, 'a', k + 1, 1) for k in range(20))
+        self.ts.addTransitions((k, 'b', k, 1) for k in range(20))
+        self.ts.addAction(20, 'a', {20: .5, 19: .5})
+        self.ts.freeze()
+        self.rfs = combineReward(lambda st: 1 if st == 20 else 0,
+                                 lambda st: -st)
+        self.options = dict(tolerance=1e-10, runs=1000)
+
+    def assertClose(self, Qx, Qy):
+        for key in Qx:
+            self.assertTrue(hausdorff(Qx[key], Qy[key]) < 1e-8)
+
+    def testIncremental(self):
+        worth = Lex(ID(0), ID(1))
+        first = ValueIterator(self.ts, self.rfs, worth, prioritized=True,
+                              **self.options)
+        #Nothing leads to 0, so changing it leaves the rest alone
+        self.ts.addAction(0, 'b', {0: .5, 1: .5})
+        cold = ValueIterator(self.ts, self.rfs, worth, **self.options)
+        warm = ValueIterator(self.ts, self.rfs, worth, prioritized=True,
+                             warm=first, **self.options)
+        self.assertClose(cold.Q, warm.Q)
+        self.assertTrue(warm.backups < first.backups / 10)
+        #Nothing changed, nothing to do
+        same = ValueIterator(self.ts, self.rfs, worth, prioritized=True,
+                             warm=warm, **self.options)
+        self.assertEqual(same.backups, 0)
+        self.assertEqual(same.Q, warm.Q)
+
+    def testParallel(self):
+        #Re-solving an unchanged model from its own result is one sweep
+        worth = Lex(ID(0), ID(1))
+        first = ArrayValueIterator(self.ts, self.rfs, worth, **self.options)
+        again = ArrayValueIterator(self.ts, self.rfs, worth, workers=2,
+                                   warm=first, **self.options)
+        self.assertEqual(again.iterations, 1)
+        self.assertClose(first.Q, again.Q)
+
+    def testOtherStructure(self):
+        #Warm starts from a separately built structure compare the two
+        other = TransitionStructure(dict(self.ts))
+        other.addAction(20, 'a', {20: .9, 19: .1})
+        worth = Lex(ID(0), ID(1))
+        for Solver in (ValueIterator, ArrayValueIterator):
+            cold = Solver(other, self.rfs, worth, **self.options)
+            old = Solver(self.ts, self.rfs, worth, **self.options)
+            warm = Solver(other, self.rfs, worth, warm=old, **self.options)
+            self.assertClose(cold.Q, warm.Q)
+            self.assertTrue(warm.iterations < cold.iterations)
+
+    def testPolicyIterator(self):
+        worth = Lex(ID(0), ID(1))
+        first = PolicyIterator(self.ts, self.rfs, worth, sweeps=5)
+        again = PolicyIterator(self.ts, self.rfs, worth, sweeps=5, warm=first)
+        self.assertEqual(again.pi, first.pi)
+        self.assertEqual(again.rounds, 1)
+
+    def testTies(self):
+        #a and b from 0 are worth the same: a cold start takes the largest
+        #action, a warm start keeps the one it had
+        ts = TransitionStructure({(0,'a',1): 1, (0,'b',1): 1, (1,'a',1): 1})
+        rfs = combineReward(lambda st: st)
+        cold = PolicyIterator(ts, rfs, ID(0), startPolicy={0: 'a'})
+        self.assertEqual(cold.policy(0), 'b')
+        cold.pi[0] = 'a'
+        warm = PolicyIterator(ts, rfs, ID(0), warm=cold)
+        self.assertEqual(warm.policy(0), 'a')
+
+    def testMismatch(self):
+        worth = Lex(ID(0), ID(1))
+        first = ValueIterator(self.ts, self.rfs, worth, **self.options)
+        #An equal spec built again is the same problem
+        again = ArrayValueIterator(self.ts, self.rfs, Lex(ID(0), ID(1)),
+                                   warm=first, **self.options)
+        self.assertEqual(again.iterations, 1)
+        other = combineReward(lambda st: 1 if st == 20 else 0,
+                              lambda st: -st)
+        cases = [(self.rfs, Lex(ID(1), ID(0)), dict()),
+                 (self.rfs, Trunc(worth), dict()),
+                 (other, worth, dict()),
+                 (self.rfs, worth, dict(gamma=.5))]
+        for Solver in (ValueIterator, ArrayValueIterator):
+            for rfs, spec, options in cases:
+                options = dict(self.options, warm=first, **options)
+                self.assertRaises(ValueError, Solver, self.ts, rfs, spec,
+                                  **options)
+
+class SweepTests(unittest.TestCase):
+    def testGrid(self):
+        points = sweep.grid(n=[2, 4], p=[.1, .3, .5])
+        self.assertEqual(len(points), 6)
+        self.assertTrue({'n': 4, 'p': .3} in points)
+
+    def testMatchesZoo(self):
+        G, W, S = ID(0), ID(1), ID(2)
+        worth = Lex(G, -W, S)
+        points = sweep.grid(n=[3, 5], p=[.2, .6, .9])
+        for workers in (1, 2):
+            rows = list(sweep.sweep('hallway', points, worth, workers=workers,
+                                    states=['start', 0]))
+            self.assertEqual(len(rows), len(points))
+            for row in rows:
+                vi = zoo.hallway(row['n'], row['p'], worth)
+                self.assertEqual(row['policy start'],
+                                 ' '.join(sorted(vi.policy('start'))))
+                self.assertEqual(row['policy 0'], 'a')
+                self.assertEqual(row['iterations'], vi.iterations)
+        #Points with the same n share their compiled structure
+        cache = dict()
+        for params in sorted(points, key=lambda params: params['n']):
+            sweep.runPoint(('hallway', params, worth, (), False, {}), cache)
+            key, compiled, rfs, result = cache['hallway']
+            self.assertEqual(key, [('n', params['n'])])
+            self.assertTrue(result.cs is compiled)
+
+    def testWarm(self):
+        X, Y = ID(0), ID(1)
+        points = sweep.grid(w=[4], h=[4], p=[.8, .81])
+        runs = []
+        for warm in (False, True):
+            runs.append(list(sweep.sweep('tgrid', points, Lex(X, Y),
+                                         workers=1, warm=warm,
+                                         tolerance=1e-8)))
+        cold, warm = runs
+        self.assertEqual(warm[0]['iterations'], cold[0]['iterations'])
+        self.assertTrue(warm[1]['iterations'] < cold[1]['iterations'])
+
+    def testSweepsStartAfresh(self):
+        X, Y = ID(0), ID(1)
+        points = sweep.grid(w=[3], h=[3], p=[.8, .81])
+        first = list(sweep.sweep('tgrid', points, Lex(X, Y), workers=1,
+                                 warm=True, tolerance=1e-8))
+        #A different spec or gamma can't warm start from the sweep before,
+        #and only the second point of each sweep starts from the first
+        for worth, options in ((Lex(Y, X), {}), (Lex(X, Y), {'gamma': .5})):
+            rows = list(sweep.sweep('tgrid', points, worth, workers=1,
+                                    warm=True, tolerance=1e-8, **options))
+            cold = zoo.tgrid(3, 3, .8, worth, tolerance=1e-8, **options)
+            self.assertEqual(rows[0]['iterations'], cold.iterations)
+        self.assertEqual(first[0]['iterations'],
+                         zoo.tgrid(3, 3, .8, Lex(X, Y),
+                                   tolerance=1e-8).iterations)
+        #Pool workers don't inherit what this process last ran either
+        sweep.runPoint(('tgrid', points[0], Lex(X, Y), (), False, {}))
+        rows = list(sweep.sweep('tgrid', points[:1], Lex(X, Y), workers=2,
+                                warm=True, tolerance=1e-8))
+        self.assertEqual(rows[0]['iterations'], first[0]['iterations'])
+        sweep.forget()
+
+    def testOutput(self):
+        X, Y = ID(0), ID(1)
+        points = sweep.grid(w=[2], h=[2, 3], p=[.8])
+        out = StringIO.StringIO()
+        rows = list(sweep.sweep('tgrid', points, Lex(X, Y), workers=1,
+                                states=[(0, 0)], out=out))
+        lines = list(csv.reader(out.getvalue().splitlines()))
+        self.assertEqual(lines[0][:4], ['h', 'p', 'w', 'policy (0, 0)'])
+        self.assertEqual(len(lines), 3)
+        out = StringIO.StringIO()
+        rows = list(sweep.sweep('ratioChoice', [{}], X | Y, workers=1,
+                                states=['start'], out=out, format='json'))
+        self.assertEqual(json.loads(out.getvalue())['policy start'], 'x')
+        #No sweeps leaves the residual infinite, which JSON can't hold
+        out = StringIO.StringIO()
+        for tolerance in (None, 1e-6):
+            rows = list(sweep.sweep('ratioChoice', [{}], X | Y, workers=1,
+                                    out=out, format='json', runs=0,
+                                    tolerance=tolerance))
+            self.assertEqual(rows[0]['residual'], float('inf'))
+        def strict(constant):
+            raise ValueError("Not JSON: %s" % constant)
+        for line in out.getvalue().splitlines():
+            row = json.loads(line, parse_constant=strict)
+            self.assertEqual(row['residual'], None)
+
+class BenchmarkTests(unittest.TestCase):
+    def testRandomStructure(self):
+        ts = zoo.randomStructure(30, 2, 4, seed=5)
+        self.assertEqual(ts.getStates(), set(range(30)))
+        for st in ts.getStates():
+            self.assertEqual(ts.getActions(st), {0, 1})
+            for act in ts.getActions(st):
+                self.assertEqual(len(ts.successors(st, act)), 4)
+        again = zoo.randomStructure(30, 2, 4, seed=5)
+        self.assertEqual(dict(again), dict(ts))
+        rfs = zoo.randomRewards(30, 3, seed=5)
+        self.assertEqual(rewardTable(rfs, range(30)).shape, (30, 3))
+
+    def testGridRewards(self):
+        rfs = zoo.tgridRewards()
+        states = sorted(zoo.tgridStructure(4, 3, .8).getStates())
+        self.assertEqual(rewardTable(rfs, states).tolist(),
+                         [list(rfs(st)) for st in states])
+        self.assertEqual(rewardTable(rfs, []).shape, (0, 2))
+
+    def testRun(self):
+        results = benchmark.run(scale=.01)
+        results = json.loads(json.dumps(results))
+        names = [case[0] for case in benchmark.cases(.01)]
+        self.assertEqual(sorted(results['cases']), sorted(names))
+        for stats in results['cases'].values():
+            self.assertTrue(stats['total values'] >= stats['actions'] > 0)
+            self.assertTrue(stats['rounds'] <= benchmark.maxRounds)
+        self.assertEqual(benchmark.compare(results, results), [])
+
+    def testCompare(self):
+        old = {'cases': {'a': {'solve seconds': 2, 'peak KB': 1000},
+                         'b': {'solve seconds': .01}}}
+        new = {'cases': {'a': {'solve seconds': 3, 'peak KB': 1300},
+                         'b': {'solve seconds': .05},
+                         'c': {'solve seconds': 9}}}
+        self.assertEqual(benchmark.compare(new, old),
+                         [('a', 'solve seconds', 2, 3)])
+        self.assertEqual(benchmark.compare(new, old, threshold=.6), [])
+
+class ObserverTests(unittest.TestCase):
+    def setUp(self):
+        self.ts = zoo.hallwayStructure(4, .3)
+        self.rfs = zoo.hallwayRewards()
+        G, W, S = ID(0), ID(1), ID(2)
+        self.general = Lex(G > 0, -W)
+        self.linear = Lex(G, -W, S)
+
+    #Run a solver with an observer, returning it and what it was told
+    def observed(self, Solver, worth, **options):
+        history = []
+        solver = Solver(self.ts, self.rfs, worth, observer=history.append,
+                        **options)
+        return solver, history
+
+    def testValueIterator(self):
+        for options in (dict(), dict(inPlace=True), dict(scc=True),
+                        dict(prioritized=True)):
+            vi, history = self.observed(ValueIterator, self.general,
+                                        tolerance=1e-8, runs=1000,
+                                        trackPolicy=True, **options)
+            self.assertTrue(vi.converged())
+            self.assertEqual([stats.iteration for stats in history],
+                             range(1, len(history) + 1))
+            self.assertEqual(sum(stats.backups for stats in history),
+                             vi.backups)
+            self.assertEqual(history[-1].values,
+                             sum(len(vals) for vals in vi.Q.values()))
+            self.assertTrue(all(stats.maxValues >= 1 for stats in history))
+            if not options: #the others report parts of the structure
+                self.assertEqual(history[-1].residual, vi.residual)
+            self.assertEqual(history[-1].policyChanges, 0)
+            self.assertTrue(sum(stats.policyChanges for stats in history) > 0)
+        self.assertEqual(len(self.observed(ValueIterator, self.general)[1]),
+                         ValueIterator.runs)
+        #Options are checked before anything is reported
+        history = []
+        self.assertRaises(ValueError, ValueIterator, self.ts, self.rfs,
+                          self.general, observer=history.append, scc=True,
+                          prioritized=True)
+        self.assertEqual(history, [])
+
+    def testWorthCalls(self):
+        plain = ValueIterator(self.ts, self.rfs, self.general, runs=5)
+        for trackPolicy in (False, True):
+            vi, history = self.observed(ValueIterator, self.general, runs=5,
+                                        trackPolicy=trackPolicy)
+            calls = sum(stats.worthCalls for stats in history)
+            #The observer's own policy lookups aren't counted
+            self.assertEqual(calls, plain.worthCalls)
+            self.assertEqual(vi.cacheStats(), plain.cacheStats())
+            changes = [stats.policyChanges for stats in history]
+            if not trackPolicy: #not worked out unless asked for
+                self.assertEqual(changes, [None] * 5)
+
+    def testArrayValueIterator(self):
+        runs = [self.observed(ArrayValueIterator, self.linear, tolerance=1e-8,
+                              workers=workers, trackPolicy=True)
+                for workers in (1, 2)]
+        for vi, history in runs:
+            self.assertEqual(len(history), vi.iterations)
+            self.assertEqual(history[-1].residual, vi.residual)
+            self.assertEqual(history[-1].values, len(vi.Q))
+            self.assertEqual(history[-1].policyChanges, 0)
+        fields = ['backups', 'values', 'worthCalls', 'residual',
+                  'policyChanges']
+        self.assertEqual(*[[[getattr(stats, name) for name in fields]
+                            for stats in history] for vi, history in runs])
+
+    def testPolicyIterator(self):
+        X, Y = ID(0), ID(1)
+        pi, history = self.observed(PolicyIterator, X - Y, seed=1)
+        pairs = sum(len(self.ts.getActions(st)) for st in self.ts.getStates())
+        self.assertEqual(len(history), pi.rounds)
+        self.assertEqual(history[-1].policyChanges, 0)
+        self.assertTrue(all(stats.worthCalls == pairs for stats in history))
+        self.assertEqual(history[-1].asDict().keys(), IterationStats.fields)
+
+    def testLogging(self):
+        out = StringIO.StringIO()
+        handler = logging.StreamHandler(out)
+        logger = logging.getLogger('specification')
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+        try:
+            PolicyIterator(self.ts, self.rfs, ID(0), observer=logStats)
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('Round 1 values:'))
+        self.assertTrue(lines[1].startswith('iteration 1: '))
+        self.assertFalse(any('without converging' in line for line in lines))
+
+    def testMaxRounds(self):
+        out = StringIO.StringIO()
+        handler = logging.StreamHandler(out)
+        logger = logging.getLogger('specification')
+        logger.addHandler(handler)
+        try:
+            pi = PolicyIterator(self.ts, self.rfs, ID(0), maxRounds=0)
+        finally:
+            logger.removeHandler(handler)
+        self.assertFalse(pi.converged)
+        self.assertEqual(out.getvalue().strip(),
+                         "Policy iteration stopped after 0 rounds without "
+                         "converging")
+
+class ReachabilityTests(unittest.TestCase):
+    def setUp(self):
+        #0, 1, 2 can't reach 3 or 4
+        self.ts = TransitionStructure({
+            (0,'a',1): .3, (0,'a',2): .7, (0,'b',2): 1,
+            (1,'a',1): 1, (2,'a',0): .5, (2,'a',2): .5,
+            (3,'a',0): 1, (3,'b',4): 1, (4,'a',3): 1})
+        self.rfs = combineReward(lambda st: 1 if st == 1 else 0,
+                                 lambda st: st * .5)
+
+    def testSolvers(self):
+        X, Y = ID(0), ID(1)
+        for Solver in (ValueIterator, ArrayValueIterator):
+            full = Solver(self.ts, self.rfs, Lex(X + Y, Y))
+            pruned = Solver(self.ts, self.rfs, Lex(X + Y, Y), initial=[0])
+            self.assertEqual(pruned.ts.getStates(), {0, 1, 2})
+            self.assertEqual(set(key for key in pruned.Q if key[0] == 3),
+                             set())
+            for st in (0, 1, 2):
+                self.assertEqual(pruned.policy(st), full.policy(st))
+                for act in self.ts.getActions(st):
+                    self.assertEqual(pruned.Q[(st, act)], full.Q[(st, act)])
+            self.assertEqual(pruned.policy(3), set())
+
+    def testPolicyIterator(self):
+        X, Y = ID(0), ID(1)
+        full = PolicyIterator(self.ts, self.rfs, X + Y, seed=0)
+        pruned = PolicyIterator(self.ts, self.rfs, X + Y, seed=0,
+                                initial=[0])
+        self.assertEqual(set(pruned.pi), {0, 1, 2})
+        for st in (0, 1, 2):
+            self.assertEqual(pruned.policy(st), full.policy(st))
+
+class VectorTests(unittest.TestCase):
+    def testOperators(self):
+        u, v = Vector([1, 2]), Vector([.5, -1])
+        self.assertEqual(list(u + v), [1.5, 1])
+        self.assertEqual(list(u - v), [.5, 3])
+        self.assertEqual(list(2 * v), [1, -2])
+        self.assertEqual(list(-u), [-1, -2])
+        self.assertEqual((len(u), u[1]), (2, 2))
+        self.assertEqual(list(u), [1, 2]) #unchanged
+        self.assertRaises(AttributeError, setattr, u, 'other', 1) #slots
+
+    def testInPlace(self):
+        u, v = Vector([1, 2]), Vector([.5, -1])
+        acc = Vector.zeros(2)
+        same = acc
+        acc += u
+        acc.addScaled(2, v)
+        scratch = acc.scratch
+        acc.addScaled(0, u)
+        self.assertTrue(acc.scratch is scratch)
+        acc *= 3
+        self.assertTrue(acc is same)
+        self.assertEqual(list(acc), [6, 0])
+        self.assertEqual(list(acc.fill(0)), [0, 0])
+
+class PolicyIteratorTests(unittest.TestCase):
+    def setUp(self):
+        self.ts = TransitionStructure({
+            (0,'a',1): .3, (0,'a',2): .7, (0,'b',2): 1,
+            (1,'a',3): 1, (1,'b',0): .5, (1,'b',2): .5,
+            (2,'a',2): .4, (2,'a',0): .6, (3,'a',3): 1})
+        self.rfs = combineReward(lambda st: 1 if st == 1 else 0,
+                                 lambda st: st * .5)
+
+    def testEvaluatePolicy(self):
+        cs = self.ts.compile()
+        P = cs.select([cs.rowIds[(st, 'a')] for st in cs.states])
+        R = rewardTable(self.rfs, cs.states)
+        V = evaluatePolicy(P, R, .8, iterative=True)
+        self.assertTrue(numpy.allclose(V, R + .8 * P.dot(V)))
+        if scipy is not None:
+            self.assertTrue(numpy.allclose(evaluatePolicy(P, R, .8), V))
+
+    def testPolicy(self):
+        X, Y = ID(0), ID(1)
+        vi = ValueIterator(self.ts, self.rfs, X + Y, gamma=.8,
+                           runs=1000, tolerance=1e-12)
+        for iterative in (False, True):
+            pi = PolicyIterator(self.ts, self.rfs, X + Y,
+                                iterative=iterative)
+            self.assertTrue(pi.converged)
+            self.assertEqual(pi.exactEvals, pi.rounds)
+            self.assertEqual(pi.evalSweeps, 0)
+            for st in self.ts.getStates():
+                self.assertEqual({pi.policy(st)}, vi.policy(st))
+            #State 3 collects its reward forever
+            self.assertAlmostEqual(pi.V[3][1], 1.5 / (1 - .8))
+        self.assertRaises(AssertionError, PolicyIterator, self.ts, self.rfs,
+                          X + Y, maxRound=5)
+        self.assertRaises(AssertionError, PolicyIterator, self.ts, self.rfs,
+                          X + Y, policy=None) #a method, not an option
+
+    def testModified(self):
+        X, Y = ID(0), ID(1)
+        exact = PolicyIterator(self.ts, self.rfs, X + Y)
+        for sweeps in (1, 3, 20):
+            pi = PolicyIterator(self.ts, self.rfs, X + Y, sweeps=sweeps,
+                                tolerance=1e-10)
+            self.assertEqual(pi.pi, exact.pi)
+            self.assertTrue(pi.evalSweeps <= sweeps * pi.rounds)
+            for st in self.ts.getStates():
+                for j in range(2):
+                    self.assertAlmostEqual(pi.V[st][j], exact.V[st][j], 8)
+
+    def testStartPolicy(self):
+        X, Y = ID(0), ID(1)
+        runs = [PolicyIterator(self.ts, self.rfs, X + Y, seed=3)
+                for i in range(2)]
+        self.assertEqual(runs[0].rounds, runs[1].rounds)
+        again = PolicyIterator(self.ts, self.rfs, X + Y,
+                               startPolicy=runs[0].pi)
+        self.assertEqual(again.rounds, 1)
+        self.assertEqual(again.pi, runs[0].pi)
+
 
 if __name__ == '__main__':
     unittest.main()
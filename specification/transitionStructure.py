@@ -1,47 +1,307 @@
 import pydot
 from PIL import Image
 import StringIO
+import gc
 
 from collections import defaultdict
+from compiledStructure import CompiledStructure
 
 #Transition structure representation of the world
 class TransitionStructure(defaultdict):
+    tolerance = 1e-9 #how far from one a distribution's total may be
+
     def __init__(self, data=dict()):
         #data : dict<(state, action, state), prob>
         for key in data: # Make sure we got the kind of data we want
             assert isinstance(key, tuple) and len(key) == 3
 
-        for state, action in {(st, act) for (st, act, sprime) in data}:
-            assert sum([prob for (st, act, sp), prob in data.items() 
-                        if st == state and act == action]) == 1
+        #Indexes kept up to date by __setitem__
+        self.states = set() #every state mentioned by a transition
+        self.actions = dict() #dict<state, set<action>>
+        self.dists = dict() #dict<(state, action), dict<state, prob>>
+        self.preds = dict() #dict<state, set<(state, action)>>
+        self.compiled = None #cached CompiledStructure, see compile()
+        self.unchecked = None #(state, action) pairs left for freeze()
+        self.edits = 0 #number of changes so far, see changedSince
+        self.changed = dict() #dict<(state, action), edits when last changed>
 
-        #Valid data, so keep track of it
+        #Keep track of the data, then check every distribution once
         super(TransitionStructure, self).__init__(lambda: 0)
-        for key, val in data.iteritems():
-            self[key] = val
-        
+        self.build()
+        self.addTransitions((st, act, sp, prob)
+                            for (st, act, sp), prob in data.iteritems())
+        self.freeze()
+
+    #Store a transition and keep the indexes in sync
+    #A probability of zero removes the transition (if there is one)
+    def __setitem__(self, key, prob):
+        if not prob:
+            self.pop(key, None)
+            return
+        super(TransitionStructure, self).__setitem__(key, prob)
+        state, action, sprime = key
+        self.touch(state, action)
+        self.states.add(state)
+        self.states.add(sprime)
+        self.actions.setdefault(state, set()).add(action)
+        self.dists.setdefault((state, action), dict())[sprime] = prob
+        self.preds.setdefault(sprime, set()).add((state, action))
+
+    #Remove a transition and keep the indexes in sync: actions left
+    #without successors and states no transition mentions go too
+    def __delitem__(self, key):
+        super(TransitionStructure, self).__delitem__(key)
+        state, action, sprime = key
+        self.touch(state, action)
+        dist = self.dists[(state, action)]
+        del dist[sprime]
+        self.preds[sprime].discard((state, action))
+        if not self.preds[sprime]:
+            del self.preds[sprime]
+        if not dist:
+            del self.dists[(state, action)]
+            self.actions[state].discard(action)
+            if not self.actions[state]:
+                del self.actions[state]
+        for st in (state, sprime):
+            if st not in self.actions and st not in self.preds:
+                self.states.discard(st)
+
+    #The other ways dict has of changing the data go through the two above
+    def pop(self, key, *default):
+        if key in self:
+            prob = self[key]
+            del self[key]
+            return prob
+        return super(TransitionStructure, self).pop(key, *default)
+
+    def popitem(self):
+        if not self:
+            raise KeyError('popitem(): dictionary is empty')
+        key = next(iter(self))
+        return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key] if key in self else default
+
+    def update(self, *args, **kwargs):
+        for key, prob in dict(*args, **kwargs).items():
+            self[key] = prob
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    #Note a change to an action's transitions
+    def touch(self, state, action):
+        self.compiled = None #arrays are stale now
+        self.edits += 1
+        self.changed[(state, action)] = self.edits
+
+    #Missing transitions have probability zero, but reading one
+    #shouldn't store it (defaultdict would insert the zero)
+    def __missing__(self, key):
+        return 0
+
     #Add a transition to the structure
     def addAction(self, state, action, results):
         #results : dict<state, prob>
-        results = {key: val for (key, val) in results.items() if val}
-        for (sprime, prob) in results.items():
-            self[(state, action, sprime)] = prob
+        self.addTransitions((state, action, sprime, prob)
+                            for (sprime, prob) in results.items() if prob)
 
-        #Make sure the probabilities are still valid
-        assert sum([prob for (st, act, sp), prob in self.items()
-                    if st == state and act == action]) == 1
+    #Add many transitions at once
+    #transitions : iterable of (state, action, state, prob), such as a
+    #              generator or zip() of arrays
+    #The distributions touched are checked straight away, or by freeze()
+    #if build() was called first
+    def addTransitions(self, transitions):
+        #The load makes many small dicts and sets, none of them garbage,
+        #so don't let the cycle collector keep rescanning them
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            store = super(TransitionStructure, self).__setitem__
+            states, actions = self.states, self.actions
+            dists, preds = self.dists, self.preds
+            touched = set()
+            pair = dist = None
+            for state, action, sprime, prob in transitions:
+                if not prob: #may remove a transition, take the slow path
+                    self[(state, action, sprime)] = prob
+                    touched.add((state, action))
+                    pair = None #its distribution may be gone now
+                    continue
+                if (state, action) != pair: #look up each group once
+                    pair = (state, action)
+                    touched.add(pair)
+                    states.add(state)
+                    if state not in actions:
+                        actions[state] = set()
+                    actions[state].add(action)
+                    if pair not in dists:
+                        dists[pair] = dict()
+                    dist = dists[pair]
+                store((state, action, sprime), prob)
+                states.add(sprime)
+                dist[sprime] = prob
+                if sprime in preds:
+                    preds[sprime].add(pair)
+                else:
+                    preds[sprime] = {pair}
+        finally:
+            if collecting:
+                gc.enable()
+        self.compiled = None
+        self.edits += 1
+        self.changed.update(dict.fromkeys(touched, self.edits))
+        if self.unchecked is None:
+            self.validate(touched)
+        else:
+            self.unchecked.update(touched)
+
+    #Put off checking distributions until freeze(), so large models can
+    #be loaded piece by piece
+    def build(self):
+        if self.unchecked is None:
+            self.unchecked = set()
+        return self
+
+    #Check everything added since build() in one pass and go back to
+    #checking each addition as it is made
+    def freeze(self, tolerance=None):
+        unchecked, self.unchecked = self.unchecked, None
+        self.validate(unchecked or (), tolerance)
+        return self
+
+    #Assert that the given actions' probabilities sum to one
+    #pairs : iterable of (state, action), all of them if None
+    #Actions whose transitions were all removed have nothing to check
+    def validate(self, pairs=None, tolerance=None):
+        if tolerance is None:
+            tolerance = self.tolerance
+        if pairs is None:
+            pairs = self.dists.keys()
+        for pair in pairs:
+            if pair not in self.dists:
+                continue
+            total = sum(self.successors(*pair).values())
+            assert abs(total - 1) <= tolerance, \
+                "%s %s has total probability %s" % (pair + (total,))
+
+    #Return the (state, action) pairs changed after the given number of
+    #edits, e.g. since a solver recorded edits
+    def changedSince(self, edits):
+        return {pair for (pair, when) in self.changed.items() if when > edits}
 
     #Return all of the states in the transition structure
+    #(the returned set is the live index, so don't modify it)
     def getStates(self):
-        starts = {state for (state, action, sprime) in self}
-        ends = {sprime for (state, action, sprime) in self}
-        return starts | ends #return the union of states
+        return self.states
 
     #Return all actions valid from a state
+    #(the returned set is the live index, so don't modify it)
     def getActions(self, state):
-        actions = {action for (st, action, sprime) in self
-                   if st == state}
-        return actions
+        return self.actions.get(state, set())
+
+    #Return the distribution over next states for an action
+    #Only successors with non-zero probability are included
+    def successors(self, state, action):
+        return self.dists.get((state, action), dict())
+
+    #Return the probability of a transition without touching the structure
+    def probability(self, state, action, sprime):
+        return self.successors(state, action).get(sprime, 0)
+
+    #Return the (state, action) pairs that can lead to a state
+    def predecessors(self, state):
+        return self.preds.get(state, set())
+
+    #Return the states that can be reached from the initial states
+    def reachable(self, initial):
+        #initial : iterable of states
+        seen = set(initial)
+        frontier = list(seen)
+        while frontier:
+            state = frontier.pop()
+            for action in self.getActions(state):
+                for sprime in self.successors(state, action):
+                    if sprime not in seen:
+                        seen.add(sprime)
+                        frontier.append(sprime)
+        return seen
+
+    #Return the strongly connected components of the states, as lists,
+    #ordered so that each comes after every component it can reach
+    #(Tarjan's algorithm, with an explicit stack instead of recursion)
+    def components(self):
+        def nextStates(state):
+            return iter({sprime for action in self.getActions(state)
+                         for sprime in self.successors(state, action)})
+        index = dict() #state -> order of discovery
+        low = dict() #state -> lowest index reachable on the stack
+        stack = [] #states not yet assigned to a component
+        onStack = set()
+        result = []
+        for root in self.states:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            onStack.add(root)
+            work = [(root, nextStates(root))]
+            while work:
+                state, children = work[-1]
+                for child in children:
+                    if child not in index: #descend into it
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        onStack.add(child)
+                        work.append((child, nextStates(child)))
+                        break
+                    elif child in onStack:
+                        low[state] = min(low[state], index[child])
+                else: #all children done
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[state])
+                    if low[state] == index[state]: #root of a component
+                        comp = []
+                        while True:
+                            member = stack.pop()
+                            onStack.discard(member)
+                            comp.append(member)
+                            if member == state:
+                                break
+                        result.append(comp)
+        return result
+
+    #Return a new structure with just the actions taken from the given
+    #states (pass a closed set such as reachable() gives, or successors
+    #outside it become states without actions)
+    #The distributions are copied whole, so they aren't checked again
+    #(this structure may have been frozen with a looser tolerance)
+    def restrict(self, states):
+        sub = TransitionStructure().build()
+        sub.addTransitions((state, action, sprime, prob)
+                           for state in states
+                           for action in self.getActions(state)
+                           for sprime, prob
+                           in self.successors(state, action).items())
+        sub.unchecked = None
+        return sub
+
+    #Return the array (CSR) form of the structure
+    #The result is cached until the structure changes
+    #like : a CompiledStructure to reuse if only the probabilities differ
+    def compile(self, like=None):
+        if self.compiled is None and like is not None:
+            self.compiled = like.reuse(self)
+        if self.compiled is None:
+            self.compiled = CompiledStructure(self)
+        return self.compiled
 
     #Display structure using graphviz
     def display(self):
@@ -2,9 +2,13 @@
 import pydot
 from PIL import Image
 import StringIO
-import copy
 
+import heapq
+import time
 from collections import defaultdict
+from specification import CachedWorth, rewardTable
+from iterationStats import IterationStats
+from options import Configurable
 
 #Add tuples as if they were vectors
 #warning: if tuples have different lengths then only the shortest length will be used
@@ -43,38 +47,340 @@ def union(sets):
 
     return current
 
-class ValueIterator:
+#Distance between two tuples (largest difference in any component)
+def vecDist(tupx, tupy):
+    return max([abs(x - y) for x, y in zip(tupx, tupy)] or [0])
+
+#Hausdorff distance between two sets of tuples
+def hausdorff(setx, sety):
+    if setx is sety or setx == sety:
+        return 0
+    if not setx or not sety: #an empty set is infinitely far from the rest
+        return float('inf')
+    return max(max(min(vecDist(x, y) for y in sety) for x in setx),
+               max(min(vecDist(x, y) for x in setx) for y in sety))
+
+#What Q depends on besides the structure: the spec (by key, so equal
+#specs built separately match), the reward function and gamma.
+#A result can only warm start another for the same problemKey.
+def problemKey(spec, rfs, gamma):
+    key = getattr(spec, 'key', None)
+    return (key() if key is not None else spec,
+            getattr(spec, 'truncate', False), rfs, gamma)
+
+class ValueIterator(Configurable):
     
-    runs = 100 #Number of iterations to use
+    backend = 'sets' #Q holds sets of vectors
+    runs = 100 #Maximum number of iterations to use
     gamma = .9
+    tolerance = None #Stop once the residual is this small (None: do every run)
+    inPlace = False #Gauss-Seidel sweeps: updates see values from the same sweep
+    dominance = False #Keep only the maximal elements of each Q value
+    cover = None #Drop successor values within this distance of a kept one
+    cap = None #Keep at most this many values from each successor
+    quantum = None #Merge values that share a cell of a grid this fine
+    cacheSize = 100000 #Number of worth values to remember (0: no cache)
+    initial = None #Only solve the states reachable from these (None: all)
+    scc = False #Solve strongly connected components one at a time
+    prioritized = False #Back up whatever changed most first (see sweep)
+    warm = None #Earlier result to start from (see warmStart)
+    observer = None #Called with an IterationStats after every sweep
+    trackPolicy = False #Work out policyChanges for the observer (else None)
     
     #Run value iteration on a transition structure
-    def __init__(self, ts, rfs, worth):
+    def __init__(self, ts, rfs, worth, **options):
         #ts : TransitionStructure
         #rfs : Vector valued reward function
         #worth : tuple of reward values -> tuple in ordering
+        #options : override any of the settings above, e.g. tolerance=1e-6
+        self.configure(options)
+        if self.scc and self.prioritized:
+            raise ValueError("Choose one of scc and prioritized")
+        #measuring : whether every backup works out how far it moved Q.
+        #Only the tolerance and the observer look at that each sweep, and
+        #it is most of the cost of a backup, so otherwise only the final
+        #sweep measures it (for residual).
+        self.measuring = self.tolerance is not None or \
+                         self.observer is not None
+        #given : the structure as passed in, edits : its edit count now,
+        #so that a later warm start can tell what has changed since
+        self.given = ts
+        self.edits = ts.edits
+        ts = self.prune(ts)
         self.ts = ts
 
 #        for state in ts.getStates(): #every state should have an action
 #            assert ts.getActions(state)
 
         self.rfs = rfs
-        self.worth = worth #evaluate the worth of a tuple
+        #Rewards only depend on the state, so evaluate them once
+        states = list(ts.getStates())
+        self.R = rewardTable(rfs, states)
+        self.rewards = dict(zip(states, map(tuple, self.R.tolist())))
+        self.k = self.R.shape[1] #number of objectives
+        self.spec = worth
+        self.problem = self.identify() #checked by a later warm start
+        #evaluate the worth of a tuple, compiled if it is a Specification
+        self.worth = getattr(worth, 'compile', lambda: worth)()
+        if self.cacheSize:
+            self.worth = CachedWorth(self.worth, self.cacheSize)
         
-        #Q : dict<(state, action), (val, val, ...)>
-        self.Q = defaultdict(lambda: {(0,) * len(self.rfs)})
+        #Q : dict<(state, action), frozenset of (val, val, ...)>
+        #Qnext is the buffer the next sweep writes into. Every sweep
+        #rewrites every entry and the sets are immutable, so the two
+        #buffers can simply be swapped rather than copied.
+        self.Q = defaultdict(lambda: frozenset([(0,) * self.k]))
+        self.Qnext = defaultdict(self.Q.default_factory)
+        changed = None
+        if self.warm is not None:
+            changed = self.warmStart(self.Q)
 
-        for run in range(self.runs):
-            self.Qnext = copy.deepcopy(self.Q)
-            for st in ts.getStates():
-                for act in ts.getActions(st):
-                    self.update(st,act)
-            self.Q = self.Qnext
+        #iterations : number of sweeps done
+        #residual : largest change to a Q value in the last sweep
+        #pruneError : furthest any dropped value was from a kept one
+        #backups : number of Q values computed
+        #worthCalls : number of worth evaluations asked for
+        #valueCount : total size of the Q value sets
+        self.iterations = 0
+        self.residual = float('inf')
+        self.pruneError = 0
+        self.backups = 0
+        self.worthCalls = 0
+        pairs = [(st, act) for st in ts.getStates()
+                 for act in ts.getActions(st)]
+        self.valueCount = sum(len(self.Q[pair]) for pair in pairs)
+        self.startObserving()
+        if self.scc:
+            self.solveComponents()
+        elif self.prioritized:
+            self.sweep(changed)
+        else:
+            for run in range(self.runs):
+                if self.inPlace:
+                    self.Qnext = self.Q
+                self.residual = self.backup(pairs, run == self.runs - 1)
+                self.Q, self.Qnext = self.Qnext, self.Q
+                self.iterations += 1
+                self.observe(self.residual)
+                if self.converged():
+                    break
+
+        del self.Qnext #only needed while iterating
 
         #Finally truncate if applicable
-        if self.worth.truncate:
+        if self.spec.truncate:
             for key, val in self.Q.items():
-                self.Q[key] = self.truncate(val)
+                self.Q[key] = frozenset(self.truncate(val))
+
+    #Update each (state, action) in pairs once, writing into Qnext
+    #measure : work out the change even if not measuring (final sweeps)
+    #Returns the largest change made, or None if not measured
+    def backup(self, pairs, measure=False):
+        measure = measure or self.measuring
+        residual = 0 if measure else None
+        for st, act in pairs:
+            old = self.Q[(st, act)]
+            self.update(st, act)
+            new = self.Qnext[(st, act)]
+            if measure:
+                residual = max(residual, hausdorff(old, new))
+            size = len(new)
+            self.valueCount += size - len(old)
+            if size > self.largest:
+                self.largest = size
+        self.backups += len(pairs)
+        if self.observer is not None:
+            self.touched.update(st for (st, act) in pairs)
+        return residual
+
+    #Start counting for observe: the backups, worth calls and time since
+    #the last report, the largest set computed since then (largest), the
+    #states backed up since then (touched) and, with trackPolicy, their
+    #policies (lastPolicy)
+    def startObserving(self):
+        self.largest = 0
+        self.touched = set([])
+        self.lastPolicy = dict()
+        self.reports = 0
+        if self.observer is not None and self.trackPolicy:
+            self.lastPolicy = self.policies(self.ts.getStates())
+        self.lastReport = (time.time(), self.backups, self.worthCalls)
+
+    #Pass the observer (if any) the stats of the iteration just done
+    #residual : the largest change it made
+    def observe(self, residual):
+        if self.observer is None:
+            return
+        now = time.time()
+        then, backups, worthCalls = self.lastReport
+        worthCalls = self.worthCalls - worthCalls
+        changes = None
+        if self.trackPolicy:
+            best = self.policies(self.touched)
+            changes = sum(1 for st in best
+                          if best[st] != self.lastPolicy.get(st))
+            self.lastPolicy.update(best)
+        self.reports += 1
+        self.observer(IterationStats(self.reports, now - then,
+                                     self.backups - backups, self.valueCount,
+                                     self.largest, worthCalls, residual,
+                                     changes))
+        self.largest = 0
+        self.touched = set([])
+        self.lastReport = (time.time(), self.backups, self.worthCalls)
+
+    #Maximal actions of each of the states, as a dict of frozensets
+    #These worth calls are left out of worthCalls and the cache stats
+    def policies(self, states):
+        worth, worthCalls = self.worth, self.worthCalls
+        if isinstance(worth, CachedWorth):
+            self.worth = worth.spec
+        try:
+            return {st: frozenset(self.policy(st)) for st in states}
+        finally:
+            self.worth, self.worthCalls = worth, worthCalls
+
+    #Solve the strongly connected components one at a time, those lower
+    #down first, so each only waits on final values from the ones below.
+    #A component without a cycle needs a single backup, the others are
+    #iterated on their own until they converge (or runs is used up).
+    #iterations and residual report the worst component.
+    def solveComponents(self):
+        self.residual = 0
+        for comp in self.ts.components():
+            pairs = [(st, act) for st in comp
+                     for act in self.ts.getActions(st)]
+            cyclic = len(comp) > 1 or \
+                     any(st in self.ts.successors(st, act) for st, act in pairs)
+            for run in range(self.runs if cyclic else 1):
+                if self.inPlace:
+                    self.Qnext = self.Q
+                residual = self.backup(pairs, cyclic and run == self.runs - 1)
+                for key in pairs:
+                    self.Q[key] = self.Qnext[key]
+                self.observe(residual)
+                if self.tolerance is not None and residual <= self.tolerance:
+                    break
+            if pairs:
+                self.iterations = max(self.iterations, run + 1)
+                if cyclic: #measured, as it stopped on tolerance or ran out
+                    self.residual = max(self.residual, residual)
+
+    #Prioritized sweeping: keep a queue of (state, action) pairs keyed on
+    #how much their successors have moved, and only back up the top one.
+    #After a backup moves the maximal values of st by d, each (s, a)
+    #leading to st is queued with priority gamma*T(s, a, st)*d. Stops when
+    #nothing left is above tolerance (0 if None) or after runs sweeps'
+    #worth of backups. residual is then the largest priority left behind.
+    #changed : the pairs to start from (all of them if None)
+    def sweep(self, changed=None):
+        self.Qnext = self.Q #always in place
+        ts = self.ts
+        pairs = [(st, act) for st in ts.getStates()
+                 for act in ts.getActions(st)]
+        tolerance = self.tolerance or 0
+        first = pairs if changed is None else \
+                [pair for pair in pairs if pair in changed]
+        priority = dict.fromkeys(first, float('inf')) #each of these once
+        queue = [(-priority[pair], i, pair) for (i, pair) in enumerate(first)]
+        heapq.heapify(queue)
+        count = len(queue) #ties go first in first out
+        budget = self.runs * len(pairs)
+        self.residual = 0
+        moved = 0 #largest change since the last report to observe
+        while queue:
+            negative, i, pair = heapq.heappop(queue)
+            if priority.get(pair) != -negative: #outdated entry
+                continue
+            if -negative <= tolerance or self.backups == budget:
+                self.residual = -negative #the largest one left
+                break
+            del priority[pair]
+            st = pair[0]
+            old = self.value(st)
+            before = self.Q[pair]
+            residual = self.backup([pair])
+            if residual is not None:
+                moved = max(moved, residual)
+            if self.backups % len(pairs) == 0: #a sweep's worth
+                self.observe(moved)
+                moved = 0
+            #Predecessors only see the maximal values, so they don't
+            #need redoing unless those moved (which they can't have if
+            #the pair's own value stayed put)
+            if self.Q[pair] == before:
+                continue
+            change = hausdorff(old, self.value(st))
+            if not change:
+                continue
+            for before in ts.predecessors(st):
+                push = self.gamma * ts.probability(before[0], before[1], st) \
+                       * change
+                if push > priority.get(before, 0):
+                    priority[before] = push
+                    heapq.heappush(queue, (-push, count, before))
+                    count += 1
+        if self.backups % max(len(pairs), 1): #the rest of a sweep
+            self.observe(moved)
+        #sweeps' worth of backups done
+        self.iterations = -(-self.backups // max(len(pairs), 1))
+
+    #What Q depends on besides the structure (see problemKey)
+    def identify(self):
+        return problemKey(self.spec, self.rfs, self.gamma)
+
+    #Copy the Q values of the earlier result self.warm (a ValueIterator or
+    #ArrayValueIterator for the same rewards and spec) into Q and return
+    #the (state, action) pairs that need redoing: those whose transitions
+    #changed since it was solved and those it has no value for.
+    #With prioritized, only these are queued at first.
+    #Raises ValueError if self.warm solved a different problem
+    def warmStart(self, Q):
+        warm = self.warm
+        if warm.problem != self.problem:
+            raise ValueError("Can only warm start from a result for the "
+                             "same spec, rewards and gamma")
+        pairs = [(st, act) for st in self.ts.getStates()
+                 for act in self.ts.getActions(st)]
+        if warm.given is self.given: #edited in place, so it knows
+            changed = self.given.changedSince(warm.edits)
+        else: #compare the two structures
+            changed = {(st, act) for (st, act) in pairs
+                       if warm.ts.successors(st, act) !=
+                       self.ts.successors(st, act)}
+        for pair in pairs:
+            if pair in warm.Q:
+                Q[pair] = frozenset(warm.Q[pair])
+            else:
+                changed.add(pair)
+        return changed
+
+    #Maximal values of a state, as its predecessors' updates use them
+    def value(self, st):
+        return self.max(union(self.Q[(st, act)]
+                              for act in self.ts.getActions(st)))
+
+    #Cut the structure down to the states reachable from initial
+    def prune(self, ts):
+        if self.initial is None:
+            return ts
+        return ts.restrict(ts.reachable(self.initial))
+
+    #Return (hits, misses) of the worth cache
+    def cacheStats(self):
+        if isinstance(self.worth, CachedWorth):
+            return self.worth.hits, self.worth.misses
+        return 0, 0
+
+    #Bound on how far the approximations (quantum, cover, cap) can move Q
+    #Each backup moves by at most pruneError, which the discount
+    #keeps from adding up to more than this.
+    def errorBound(self):
+        return self.pruneError / (1 - self.gamma)
+
+    #Decide whether the last sweep was good enough to stop
+    def converged(self):
+        return self.tolerance is not None and self.residual <= self.tolerance
 
     # Truncate a value
     def truncate(self, vals):
@@ -83,27 +389,77 @@ class ValueIterator:
     #Update Q[st, act] using value iteration                
     def update(self, st, act):
         #Calculate future reward estimate
-        fut = setSum([setMult(self.ts[(st,act,sp)], 
-                             self.max(union(self.Q[(sp,ap)] 
-                                            for ap in self.ts.getActions(sp))))
-                      for sp in self.ts.getStates()])
+        fut = setSum([setMult(prob, 
+                             self.thin(self.merge(self.max(union(
+                                 self.Q[(sp,ap)]
+                                 for ap in self.ts.getActions(sp))))))
+                      for sp, prob in self.ts.successors(st, act).items()])
         
-        self.Qnext[(st, act)] = setAdd({self.rfs(st)}, setMult(self.gamma, fut))
+        vals = self.merge(setAdd({self.rewards[st]},
+                                 setMult(self.gamma, fut)))
+        if self.dominance: #the rest can never be chosen by policy or max
+            vals = self.max(vals)
+        self.Qnext[(st, act)] = frozenset(vals)
+
+    #Merge values that differ by little more than float noise
+    #Values are hashed to cells quantum wide and each cell keeps its
+    #smallest member, so values that are alone in a cell stay exact
+    def merge(self, values):
+        if self.quantum is None:
+            return values
+        cells = dict()
+        for val in values:
+            cell = tuple(int(round(component / self.quantum))
+                         for component in val)
+            cells.setdefault(cell, []).append(val)
+        kept = set([])
+        for members in cells.values():
+            rep = min(members)
+            kept.add(rep)
+            for val in members:
+                self.pruneError = max(self.pruneError, vecDist(val, rep))
+        return kept
+
+    #Shrink a set of values before it goes into a sum over successors
+    #Every dropped value is within pruneError of one that is kept
+    def thin(self, values):
+        if self.cover is None and (self.cap is None or len(values) <= self.cap):
+            return values
+        kept = []
+        for val in sorted(values): #cover greedily
+            if self.cover is None or \
+               all(vecDist(val, k) > self.cover for k in kept):
+                kept.append(val)
+        if self.cap is not None and len(kept) > self.cap:
+            #Keep spread out values: add the one furthest from the rest
+            kept, rest = kept[:1], kept[1:]
+            while len(kept) < self.cap:
+                far = max(rest, key=lambda v: min(vecDist(v, k) for k in kept))
+                kept.append(far)
+                rest.remove(far)
+        for val in values:
+            self.pruneError = max(self.pruneError,
+                                  min(vecDist(val, k) for k in kept))
+        return set(kept)
 
 
     #Find the max of a set of values using the new ordering
     #Returns the set of maximal elements
+    #Worth values (numbers or Lex tuples) are totally ordered, so these
+    #are the values whose worth equals the largest one. A single value
+    #is maximal whatever its worth, so it isn't scored.
     def max(self, values):
-        best = set([])
-        for val in values: #go through comparing each value
-            if all(self.worth(val) == self.worth(elem) for elem in best):
-                best.add(val) #Equal to other best elements
-            elif all(self.worth(val) > self.worth(elem) for elem in best):
-                best = {val} #Better than previous guess
-        return best
+        if len(values) <= 1:
+            return set(values)
+        scored = [(self.worth(val), val) for val in values]
+        self.worthCalls += len(scored)
+        top = max(score for (score, val) in scored)
+        return {val for (score, val) in scored if score == top}
         
     #Return the set of maximal actions from a state
     def policy(self, st):
+        if not self.ts.getActions(st): #nothing to choose (or pruned)
+            return set([])
         best = self.max(union(self.Q[(st, act)] #maximal vals
                               for act in self.ts.getActions(st)))
         #Inefficiently find the corresponding actions
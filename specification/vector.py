@@ -1,22 +1,59 @@
+#Simple vector class to allow for vector addition and scalar multiplication
+#The components live in one numpy array, and the in-place methods let loops
+#accumulate sums without making a new Vector for every term
+import numpy
 
+class Vector(object):
+    __slots__ = ('data', 'scratch')
 
-#Simple vector class to allow for vector addition and scalar multiplication
-class Vector:
     def __init__(self, vals):
-        self.data = list(vals)
-    
+        self.data = numpy.array(vals, dtype=float)
+        self.scratch = None #buffer for addScaled, made on first use
+
+    #Vector of k zeros, e.g. to accumulate into
+    @staticmethod
+    def zeros(k):
+        return Vector(numpy.zeros(k))
+
     def __repr__(self):
-        return self.data.__repr__()
+        return self.data.tolist().__repr__()
 
     def __getitem__(self, idx):
         return self.data[idx]
+    def __len__(self):
+        return len(self.data)
+    def __iter__(self):
+        return iter(self.data.tolist())
+
     def __add__(self, other):
-        return Vector([x + y for (x, y) in zip(self.data, other.data)])
+        return Vector(self.data + other.data)
     def __rmul__(self, val):
-        return Vector([val*x for x in self.data])
+        return Vector(val * self.data)
     def __neg__(self):
-        return Vector([-x for x in self.data])
+        return Vector(-self.data)
     def __sub__(self, other):
-        return self.__add__(-other)
-    def __len__(self):
-        return len(self.data)
+        return Vector(self.data - other.data)
+
+    #In place versions: change this vector and return it
+    def __iadd__(self, other):
+        self.data += other.data
+        return self
+    def __isub__(self, other):
+        self.data -= other.data
+        return self
+    def __imul__(self, val):
+        self.data *= val
+        return self
+
+    #self += val*other, without allocating once scratch exists
+    def addScaled(self, val, other):
+        if self.scratch is None:
+            self.scratch = numpy.empty_like(self.data)
+        numpy.multiply(other.data, val, out=self.scratch)
+        numpy.add(self.data, self.scratch, out=self.data)
+        return self
+
+    #Set every component to x
+    def fill(self, x):
+        self.data.fill(x)
+        return self
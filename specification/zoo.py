@@ -1,17 +1,24 @@
 #file: zoo.py
 #A collection of transition structures with value iteration in place
+#Each model comes as <model>Structure(params) -> TransitionStructure,
+#a rewards builder and <model>(params, worth) solving the two together
+
+import random
+
+import numpy
 
 from transitionStructure import *
 from valueIterator import *
+from solver import *
 from specification import *
 
 #### LITTMAN'S HALLWAY ####
-def hallway(n, p, worth):
+def hallwayStructure(n, p):
     #n: length of hallway in the safe direction
     #p: probability of hitting wall even in safe direction
     
     #Set up the transition structure
-    ts = TransitionStructure()
+    ts = TransitionStructure().build()
     ts.addAction('start','sit',{'start': 1})
     ts.addAction('start','a',{'wall': 1})
     ts.addAction('wall','a',{'goal': 1})
@@ -22,22 +29,25 @@ def hallway(n, p, worth):
     ts.addAction(n, 'a', {'goal': 1})
     for k in range(1, n):
         ts.addAction(k, 'a', {k+1: 1})
-    
-    #And the reward function
+    ts.freeze()
+    return ts
+
+#Rewards (goal, wall, start) shared by the hallways
+def hallwayRewards():
     G = lambda st: 1 if st == 'goal' else 0
     W = lambda st: 1 if st == 'wall' else 0
     S = lambda st: 1 if st == 'start' else 0
-    rfs = combineReward(G, W, S)
-    
-    vi = ValueIterator(ts, rfs, worth)
-    return vi
+    return combineReward(G, W, S)
+
+def hallway(n, p, worth, **options):
+    return solve(hallwayStructure(n, p), hallwayRewards(), worth, **options)
 
-def hallwaydoublestart(n, p, worth):
+def hallwaydoublestartStructure(n, p):
     #n: length of hallway in the safe direction
     #p: probability of hitting wall even in safe direction
     
     #Set up the transition structure
-    ts = TransitionStructure()
+    ts = TransitionStructure().build()
     ts.addAction('start','sit',{'start2': 1})
     ts.addAction('start2', 'sit', {'start': 1})
     ts.addAction('start','a',{'wall': 1})
@@ -49,25 +59,21 @@ def hallwaydoublestart(n, p, worth):
     ts.addAction(n, 'a', {'goal': 1})
     for k in range(1, n):
         ts.addAction(k, 'a', {k+1: 1})
-    
-    #And the reward function
-    G = lambda st: 1 if st == 'goal' else 0
-    W = lambda st: 1 if st == 'wall' else 0
-    S = lambda st: 1 if st == 'start' else 0
-    rfs = combineReward(G, W, S)
-    
-    vi = ValueIterator(ts, rfs, worth)
-    return vi
+    ts.freeze()
+    return ts
 
+def hallwaydoublestart(n, p, worth, **options):
+    return solve(hallwaydoublestartStructure(n, p), hallwayRewards(), worth,
+                 **options)
 
 
 #### TWO WAY LITTMAN's HALLWAY ####
-def twohallway(n, p, worth):
+def twohallwayStructure(n, p):
     #n: length of hallway in the safe direction
     #p: probability of hitting wall even in safe direction
     
     #Set up the transition structure
-    ts = TransitionStructure()
+    ts = TransitionStructure().build()
     ts.addAction('start','sit',{'start': 1})
     ts.addAction('start','a',{'wall': 1})
     ts.addAction('wall', 'z',{'start': 1})
@@ -83,19 +89,16 @@ def twohallway(n, p, worth):
     for k in range(1, n):
         ts.addAction(k, 'a', {k+1: 1})
         ts.addAction(k+1, 'z', {k: 1})
-    
-    #And the reward function
-    G = lambda st: 1 if st == 'goal' else 0
-    W = lambda st: 1 if st == 'wall' else 0
-    S = lambda st: 1 if st == 'start' else 0
-    rfs = combineReward(G, W, S)
-    
-    vi = ValueIterator(ts, rfs, worth)
-    return vi
+    ts.freeze()
+    return ts
+
+def twohallway(n, p, worth, **options):
+    return solve(twohallwayStructure(n, p), hallwayRewards(), worth,
+                 **options)
 
 #### CHOICE OF RATIOS ###
-def ratioChoice(worth):
-    ts = TransitionStructure({
+def ratioChoiceStructure():
+    return TransitionStructure({
         ('start','x','x0A'): 1, ('start','y','y0A'): 1, ('start','z','z0A'): 1,
         ('x0A', 'x', 'x1B'): 1, ('y0A','y','y1B'): 1, ('z0A','z','z1B'): 1,
         ('x1B', 'x', 'x2' ): 1, ('y1B','y','y2B'): 1, ('z1B','z','z2A'): 1,
@@ -105,13 +108,18 @@ def ratioChoice(worth):
         ('x5B', 'x', 'end'): 1, ('y5B','y','end'): 1, ('z5B','z','end'): 1,
         ('end', 'sit', 'end'): 1
     })
+
+#Rewards (A, B) counting the states ending in each letter
+def ratioRewards():
     A = lambda st: 1 if st.endswith('A') else 0
     B = lambda st: 1 if st.endswith('B') else 0
-    rfs = combineReward(A, B)
-    return ValueIterator(ts, rfs, worth)
+    return combineReward(A, B)
 
-def ratioChoiceSit(worth):
-    ts = TransitionStructure({
+def ratioChoice(worth, **options):
+    return solve(ratioChoiceStructure(), ratioRewards(), worth, **options)
+
+def ratioChoiceSitStructure():
+    return TransitionStructure({
         ('start', 'sit', 'start'): 1,
         ('start','x','x0A'): 1, ('start','y','y0A'): 1, ('start','z','z0A'): 1,
         ('x0A', 'x', 'x1B'): 1, ('y0A','y','y1B'): 1, ('z0A','z','z1B'): 1,
@@ -122,39 +130,88 @@ def ratioChoiceSit(worth):
         ('x5B', 'x', 'end'): 1, ('y5B','y','end'): 1, ('z5B','z','end'): 1,
         ('end', 'sit', 'end'): 1
     })
-    A = lambda st: 1 if st.endswith('A') else 0
-    B = lambda st: 1 if st.endswith('B') else 0
-    rfs = combineReward(A, B)
-    return ValueIterator(ts, rfs, worth)
+
+def ratioChoiceSit(worth, **options):
+    return solve(ratioChoiceSitStructure(), ratioRewards(), worth, **options)
 
 
 #### TEMPERATURE GRID ####
-def tgrid(w, h, p, worth):
+def tgridStructure(w, h, p):
     #w: width, h: height, p: transition prob
-    ts = TransitionStructure()
     q = (1-p)/2
-    for i in range(w):
-        for j in range(h):
-            u = 0 if j == 0 else 1
-            d = 0 if j == h - 1 else 1
-            l = 0 if i == 0 else 1
-            r = 0 if i == w - 1 else 1
-            here = (i, j)
-            up = (i, j-1)
-            down = (i, j+1)
-            left = (i-1, j)
-            right = (i+1, j)
-            ts.addAction(here, 'r', {right: p*r, up: q*u, down: q*d,
-                                     here: 1-(p*r + q*u + q*d)})
-            ts.addAction(here, 'l', {left: p*l, up: q*u, down: q*d,
-                                     here: 1-(p*l + q*u + q*d)})
-            ts.addAction(here, 'u', {up: p*u, left: q*l, right: q*r,
-                                     here: 1-(p*u + q*l + q*r)})
-            ts.addAction(here, 'd', {down: p*d, left: q*l, right: q*r,
-                                     here: 1-(p*d + q*l + q*r)})
-
-    X = lambda st: st[0]
-    Y = lambda st: st[1]
-    rfs = combineReward(X, Y)
-    return ValueIterator(ts, rfs, worth)
+    def transitions():
+        for i in range(w):
+            for j in range(h):
+                u = 0 if j == 0 else 1
+                d = 0 if j == h - 1 else 1
+                l = 0 if i == 0 else 1
+                r = 0 if i == w - 1 else 1
+                here = (i, j)
+                up = (i, j-1)
+                down = (i, j+1)
+                left = (i-1, j)
+                right = (i+1, j)
+                for act, dist in (
+                        ('r', {right: p*r, up: q*u, down: q*d,
+                               here: 1-(p*r + q*u + q*d)}),
+                        ('l', {left: p*l, up: q*u, down: q*d,
+                               here: 1-(p*l + q*u + q*d)}),
+                        ('u', {up: p*u, left: q*l, right: q*r,
+                               here: 1-(p*u + q*l + q*r)}),
+                        ('d', {down: p*d, left: q*l, right: q*r,
+                               here: 1-(p*d + q*l + q*r)})):
+                    for sp, prob in dist.items():
+                        if prob:
+                            yield here, act, sp, prob
+    #Load everything, then check all the distributions in one pass
+    ts = TransitionStructure().build()
+    ts.addTransitions(transitions())
+    return ts.freeze()
+
+#Rewards (x, y) giving the position on the grid
+def tgridRewards():
+    #a column of the positions as an (n, 2) array
+    def column(i):
+        return lambda sts: numpy.array(sts, dtype=float).reshape(-1, 2)[:, i]
+    X = batchReward(lambda st: st[0], column(0))
+    Y = batchReward(lambda st: st[1], column(1))
+    return combineReward(X, Y)
+
+def tgrid(w, h, p, worth, **options):
+    return solve(tgridStructure(w, h, p), tgridRewards(), worth, **options)
     
+
+
+#### RANDOM SPARSE MDP ####
+def randomStructure(n, actions, branching, seed=None):
+    #n: number of states, labelled 0 to n-1
+    #actions: number of actions from each state, labelled 0 to actions-1
+    #branching: number of successors of each action
+    #seed: seed for the random choices, so the same arguments give the
+    #      same structure
+    rng = random.Random(seed)
+    branching = min(branching, n)
+    def transitions():
+        for st in range(n):
+            for act in range(actions):
+                successors = rng.sample(xrange(n), branching)
+                weights = [rng.random() + .01 for sp in successors]
+                total = sum(weights)
+                for sp, weight in zip(successors, weights):
+                    yield st, act, sp, weight / total
+    ts = TransitionStructure().build()
+    ts.addTransitions(transitions())
+    return ts.freeze()
+
+#Rewards with k objectives, each uniform in [0, 1) for every state
+def randomRewards(n, k, seed=None):
+    rng = random.Random(seed)
+    tables = [numpy.array([rng.random() for st in range(n)])
+              for obj in range(k)]
+    return combineReward(*[batchReward(lambda st, table=table: table[st],
+                                       lambda sts, table=table: table[sts])
+                           for table in tables])
+
+def randomMDP(n, actions, branching, k, worth, seed=None, **options):
+    return solve(randomStructure(n, actions, branching, seed),
+                 randomRewards(n, k, seed), worth, **options)